@@ -1,266 +1,3268 @@
 #!/usr/bin/env python
 
+import argparse
+import bisect
+import csv
+import fnmatch
+import hashlib
+import io
+import json
+import logging
+import mmap
+import multiprocessing
 import os
-import svgwrite
+import select
+import shutil
+import socket
+import struct
 import sys
+import tempfile
 import subprocess
+import threading
+import time
+import xml.sax.saxutils
+import zlib
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+try:
+    import tomllib
+except ImportError:
+    try:
+        import toml as tomllib
+    except ImportError:
+        tomllib = None
+
+class ProfilerStage:
+    def __init__(self, profiler, name):
+        """ *ProfilerStage*: Initialize a timer for one run of stage *name*.
+        """
+        self._profiler = profiler
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self):
+        """ *ProfilerStage*: Start timing. """
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        """ *ProfilerStage*: Stop timing and record the duration. """
+        self._profiler.record(self._name, self._start, time.time())
+        return False
+
+class Profiler:
+    def __init__(self):
+        """ *Profiler*: Initialize a (disabled) stage profiler. """
+        self._enabled = False
+        self._lock = threading.Lock()
+        self._origin = time.time()
+        self._stages = {}
+        self._counters = {}
+        self._events = []
+        self._null_stage = NullStage()
+
+    def enable(self):
+        """ *Profiler*: Start recording. """
+        self._enabled = True
+        self._origin = time.time()
+
+    def stage(self, name):
+        """ *Profiler*: Return a context manager that times stage *name*. """
+        if not self._enabled:
+            return self._null_stage
+        return ProfilerStage(self, name)
+
+    def record(self, name, start, end):
+        """ *Profiler*: Record that stage *name* ran from *start* to *end*.
+        """
+        duration = end - start
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = [0, 0.0, 0.0]
+                self._stages[name] = stage
+            stage[0] += 1
+            stage[1] += duration
+            stage[2] = max(stage[2], duration)
+            self._events.append({"stage": name,
+              "start": round(start - self._origin, 6),
+              "duration": round(duration, 6),
+              "thread": threading.current_thread().name})
+
+    def count(self, name, amount=1):
+        """ *Profiler*: Add *amount* to the counter *name*. """
+        if self._enabled:
+            with self._lock:
+                self._counters[name] = self._counters.get(name, 0) + amount
+
+    def report(self):
+        """ *Profiler*: Return a human readable report. """
+        with self._lock:
+            lines = ["{0:<20} {1:>7} {2:>10} {3:>10} {4:>10}".format(
+              "Stage", "Count", "Total(s)", "Mean(ms)", "Max(ms)")]
+            for name in sorted(self._stages.keys()):
+                count, total, maximum = self._stages[name]
+                lines.append(
+                  "{0:<20} {1:>7} {2:>10.3f} {3:>10.2f} {4:>10.2f}".format(
+                  name, count, total, 1000.0 * total / count,
+                  1000.0 * maximum))
+            for name in sorted(self._counters.keys()):
+                lines.append("{0:<20} {1:>7}".format(name,
+                  self._counters[name]))
+            return "\n".join(lines)
+
+    def trace_write(self, file_name):
+        """ *Profiler*: Write everything recorded so far to *file_name* as
+            JSON. """
+        # Check argument types:
+        assert isinstance(file_name, str)
+
+        with self._lock:
+            stages = {}
+            for name, stage in self._stages.items():
+                stages[name] = {"count": stage[0], "total": stage[1],
+                  "maximum": stage[2]}
+            trace = {"started": self._origin, "argv": sys.argv[1:],
+              "stages": stages, "counters": self._counters,
+              "events": self._events}
+        out_file = open(file_name, "w")
+        json.dump(trace, out_file, indent=1, sort_keys=True)
+        out_file.close()
+
+class NullStage:
+    def __enter__(self):
+        """ *NullStage*: Do nothing. """
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        """ *NullStage*: Do nothing. """
+        return False
+
+# Everything in the render pipeline reports to this one profiler, which
+# costs nothing until *main* enables it:
+profiler = Profiler()
+
+class PipelineStage:
+    def __init__(self, function, workers=1, size=2):
+        """ *PipelineStage*: Initialize a stage of the render pipeline that
+            calls *function* on every item *put* into it from *workers*
+            threads.  At most *size* items wait for a thread, so *put*
+            blocks once the stage falls behind; this keeps the stages
+            before it from racing ahead and bounds the memory in use. """
+        # Check argument types:
+        assert isinstance(workers, int) and workers >= 1
+        assert isinstance(size, int) and size >= 1
+
+        # Load up *self* and start the threads:
+        self._function = function
+        self._queue = queue.Queue(size)
+        self._error = None
+        self._threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def work(self):
+        """ *PipelineStage*: Process items until told to stop.  After an
+            error the remaining items are just drained so that *put* never
+            blocks forever; *close* reports the error. """
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    self._function(item)
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def put(self, item):
+        """ *PipelineStage*: Hand *item* to the stage, waiting for room. """
+        self._queue.put(item)
+
+    def drain(self):
+        """ *PipelineStage*: Wait until every item so far is processed. """
+        self._queue.join()
+
+    def close(self):
+        """ *PipelineStage*: Finish all of the items, stop the threads and
+            raise the first error that a thread ran into, if any. """
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+# Drawers are checked once by *catalog_validate* when their catalog is
+# loaded, so the per drawer argument checks only run when --strict sets
+# this:
+strict = False
+
+class Drawer(object):
+    # Catalogs can hold hundreds of thousands of drawers, so each one is
+    # kept as small as possible: no per instance dictionary, and its lines
+    # are tuples of strings shared through its organizer's string table:
+    __slots__ = ("_organizer", "_key", "_front_lines", "_bottom_lines")
 
-class Drawer:
     def __init__(self, organizer, key, front_lines, bottom_lines=[]):
-	# Check argment types:
-	assert isinstance(organizer, Organizer)
-	assert isinstance(key, str)
-	assert isinstance(front_lines, list)
-	assert isinstance(bottom_lines, list)
-
-	# Load up *self*:
-	self._organizer = organizer
-	self._key = key
-	self._front_lines = front_lines
-	self._bottom_lines = bottom_lines
+        # Check argment types:
+        if strict:
+            assert isinstance(organizer, Organizer)
+            assert isinstance(key, str)
+            assert isinstance(front_lines, list)
+            assert isinstance(bottom_lines, list)
+
+        # Load up *self*:
+        shared = organizer._strings.setdefault
+        self._organizer = organizer
+        self._key = key
+        self._front_lines = tuple([shared(line, line) for line in front_lines])
+        self._bottom_lines = tuple([shared(line, line)
+          for line in bottom_lines])
+
+class InkscapeConverter:
+    def __init__(self, workers=1):
+        """ *InkscapeConverter*: Initialize. """
+        # Check argument types:
+        assert isinstance(workers, int) and workers >= 1
+
+        # Load up *self*:
+        self._workers = workers
+
+    def convert(self, svg_file_name, pdf_file_name):
+        """ *InkscapeConverter*: Convert *svg_file_name* into *pdf_file_name*.
+        """
+        # Check argument types:
+        assert isinstance(svg_file_name, str)
+        assert isinstance(pdf_file_name, str)
+
+        # Convert to pdf:
+        command = self.command(svg_file_name, pdf_file_name)
+        try:
+            with profiler.stage("inkscape"):
+                subprocess.check_call(command)
+        except (OSError, subprocess.CalledProcessError):
+            print("Command '{0}' failed".format(" ".join(command)))
+
+    def command(self, svg_file_name, pdf_file_name):
+        """ *InkscapeConverter*: Return the command, as a list of arguments,
+            that converts *svg_file_name* into *pdf_file_name*.  It is run
+            without a shell, so the file names need no quoting. """
+        return ["inkscape", "-f", svg_file_name, "-A", pdf_file_name]
+
+    def close(self):
+        """ *InkscapeConverter*: Release any resources held by *self*. """
+        pass
+
+# How long (seconds) an `inkscape --shell` may go without answering before
+# it is given up on and the page is converted with the one-shot command:
+SHELL_TIMEOUT = 60.0
+
+def inkscape_version():
+    """ Return the major version number of the installed `inkscape` or
+        *None* if it cannot be run or does not say. """
+    try:
+        null = open(os.devnull, "w")
+        try:
+            output = subprocess.check_output(["inkscape", "--version"],
+              stderr=null)
+        finally:
+            null.close()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    words = output.decode("latin-1").split()
+    for index in range(len(words) - 1):
+        major = words[index + 1].split(".")[0]
+        if words[index] == "Inkscape" and major.isdigit():
+            return int(major)
+    return None
+
+class InkscapeShell:
+    def __init__(self, actions, timeout=SHELL_TIMEOUT):
+        """ *InkscapeShell*: Start a long-lived `inkscape --shell` process
+            that speaks the 1.x action syntax if *actions* is *True* and the
+            0.92 command line syntax otherwise, and give up on it whenever
+            it takes more than *timeout* seconds to answer. """
+        # Check argument types:
+        assert isinstance(actions, bool)
+        assert isinstance(timeout, float)
+
+        # Start the process; *OSError* propagates if there is no *inkscape*:
+        self._actions = actions
+        self._timeout = timeout
+        self._null = open(os.devnull, "w")
+        self._process = subprocess.Popen(["inkscape", "--shell"],
+          stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self._null)
+        if self.prompt_wait() is None:
+            self.close()
+            raise OSError("inkscape --shell did not start")
+
+    def prompt_wait(self):
+        """ *InkscapeShell*: Return the output up to the next '>' prompt or
+            *None* if the process went away or timed out first (in which
+            case it is killed). """
+        # The prompt is a '>' (followed by a space in 1.x) after which the
+        # shell waits for input, so it is a '>' at the end of the output
+        # with nothing else arriving soon after:
+        process = self._process
+        stdout = process.stdout.fileno()
+        deadline = time.time() + self._timeout
+        characters = []
+        while True:
+            text = "".join(characters)
+            if text.rstrip(" ").endswith(">"):
+                ready = select.select([stdout], [], [], 0.05)[0]
+                if not ready:
+                    return text.rstrip(" ")[:-1]
+            else:
+                ready = select.select([stdout], [], [],
+                  max(0.0, deadline - time.time()))[0]
+                if not ready:
+                    process.kill()
+                    return None
+            data = os.read(stdout, 4096)
+            if not data:
+                return None
+            characters.append(data.decode("latin-1"))
+
+    def convert(self, svg_file_name, pdf_file_name):
+        """ *InkscapeShell*: Convert *svg_file_name* into *pdf_file_name*
+            and return *True* if *pdf_file_name* was written. """
+        # Check argument types:
+        assert isinstance(svg_file_name, str)
+        assert isinstance(pdf_file_name, str)
+
+        if self._actions:
+            command = ("file-open:{0}; export-filename:{1}; export-do; "
+              "file-close\n").format(svg_file_name, pdf_file_name)
+        else:
+            command = "-f {0} -A {1}\n".format(quote(svg_file_name),
+              quote(pdf_file_name))
+
+        # A stale *pdf_file_name* must not pass for a converted one:
+        if os.path.exists(pdf_file_name):
+            os.remove(pdf_file_name)
+        with profiler.stage("inkscape.shell"):
+            try:
+                self._process.stdin.write(command.encode("latin-1"))
+                self._process.stdin.flush()
+            except (IOError, OSError):
+                return False
+            if self.prompt_wait() is None:
+                return False
+        return (os.path.exists(pdf_file_name) and
+          os.path.getsize(pdf_file_name) > 0)
+
+    def close(self):
+        """ *InkscapeShell*: Shut down the shell process. """
+        process = self._process
+        try:
+            process.stdin.write("quit\n".encode("latin-1"))
+            process.stdin.close()
+        except (IOError, OSError):
+            pass
+        process.wait()
+        self._null.close()
+
+class InkscapeShellConverter(InkscapeConverter):
+    def __init__(self, workers=1):
+        """ *InkscapeShellConverter*: Initialize. """
+        InkscapeConverter.__init__(self, workers)
+
+        # Load up *self*:
+        self._idle_shells = queue.Queue()
+        self._shells = []
+        self._shells_lock = threading.Lock()
+        self._shell_broken = False
+        self._version = None
+
+    def convert(self, svg_file_name, pdf_file_name):
+        """ *InkscapeShellConverter*: Convert *svg_file_name* into
+            *pdf_file_name* through an idle shell, falling back to a
+            one-shot `inkscape` when no shell can be had.  A shell that
+            fails a page is shut down and no more are started. """
+        # Check argument types:
+        assert isinstance(svg_file_name, str)
+        assert isinstance(pdf_file_name, str)
+
+        # Grab an idle shell or start a new one (at most one per worker).
+        # The syntax to speak comes from `inkscape --version` (the 1.x
+        # shell banner looks just like the 0.92 one):
+        shell = None
+        try:
+            shell = self._idle_shells.get_nowait()
+        except queue.Empty:
+            with self._shells_lock:
+                if self._version is None and not self._shell_broken:
+                    with profiler.stage("inkscape.version"):
+                        self._version = inkscape_version()
+                    self._shell_broken = self._version is None
+            if not self._shell_broken:
+                try:
+                    with profiler.stage("inkscape.start"):
+                        shell = InkscapeShell(self._version >= 1,
+                          SHELL_TIMEOUT)
+                except OSError:
+                    self._shell_broken = True
+                else:
+                    with self._shells_lock:
+                        self._shells.append(shell)
+
+        if shell is not None:
+            if shell.convert(svg_file_name, pdf_file_name):
+                self._idle_shells.put(shell)
+                return
+            self._shell_broken = True
+            with self._shells_lock:
+                self._shells.remove(shell)
+            shell.close()
+        InkscapeConverter.convert(self, svg_file_name, pdf_file_name)
+
+    def close(self):
+        """ *InkscapeShellConverter*: Shut down all of the shells. """
+        for shell in self._shells:
+            shell.close()
+        self._shells = []
+        self._idle_shells = queue.Queue()
+
+# Helvetica advance widths (in 1/1000 em) for the printable ASCII characters
+# starting at ' ', taken from the standard Adobe AFM file:
+HELVETICA_WIDTHS = (
+  278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278,
+  278, 556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584,
+  584, 556, 1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556,
+  833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278,
+  278, 278, 469, 556, 333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222,
+  500, 222, 833, 556, 556, 556, 556, 333, 500, 278, 556, 500, 722, 500, 500,
+  500, 334, 260, 334, 584)
+
+# The SVG text is "1.2mm" inside a viewBox measured in millimeters, which
+# inkscape scales at 96 user units per inch, so it is really this tall (mm):
+FONT_SIZE = 1.2 * 96.0 / 25.4
+
+# Labels that are too long are shrunk, but never below this fraction of
+# *FONT_SIZE*, and are kept this far (mm) from the drawer edges:
+MINIMUM_FONT_SCALE = 0.6
+TEXT_MARGIN = 1.0
+
+class FontMetrics:
+    # Bump this whenever the format of the cached metrics files changes:
+    VERSION = 1
+
+    def __init__(self, family, widths, default_width):
+        """ *FontMetrics*: Initialize the metrics of the font *family* from
+            *widths*, a dictionary that maps character codes to advance
+            widths in thousandths of an em, using *default_width* for any
+            other characters. """
+        # Check argument types:
+        assert isinstance(family, str)
+        assert isinstance(widths, dict)
+        assert isinstance(default_width, float)
+
+        # Load up *self*:
+        self._family = family
+        self._widths = widths
+        self._default_width = default_width
+        self._text_widths = {}
+
+    def width(self, text):
+        """ *FontMetrics*: Return the advance width of *text* in ems. """
+        # Labels repeat a lot, so remember the widths already measured:
+        text_widths = self._text_widths
+        width = text_widths.get(text)
+        if width is None:
+            widths = self._widths
+            default_width = self._default_width
+            width = 0.0
+            for character in text_unicode(text):
+                width += widths.get(ord(character), default_width)
+            width /= 1000.0
+            if len(text_widths) >= 10000:
+                text_widths.clear()
+            text_widths[text] = width
+        return width
+
+    @staticmethod
+    def load(font_file_name, cache_directory):
+        """ *FontMetrics*: Return the metrics of the TrueType or OpenType font
+            in *font_file_name*.  Reading a font needs *fontTools*, so the
+            metrics are cached as JSON in *cache_directory*. """
+        # Check argument types:
+        assert isinstance(font_file_name, str)
+        assert isinstance(cache_directory, str)
+
+        # Use the cached metrics if the font has not changed since:
+        font_file_name = os.path.abspath(font_file_name)
+        status = os.stat(font_file_name)
+        stamp = [status.st_mtime, status.st_size]
+        cache_file_name = os.path.join(cache_directory, "metrics-{0}.json".
+          format(hashlib.sha1(utf8_bytes(font_file_name)).hexdigest()[:16]))
+        try:
+            in_file = open(cache_file_name, "rb")
+            metrics = json.loads(in_file.read().decode("utf-8"))
+            in_file.close()
+        except (IOError, OSError, ValueError):
+            metrics = {}
+        if metrics.get("version") != FontMetrics.VERSION or \
+          metrics.get("stamp") != stamp:
+            try:
+                from fontTools.ttLib import TTFont
+            except ImportError:
+                raise ValueError("{0}: reading fonts needs the 'fontTools' "
+                  "module".format(font_file_name))
+            font = TTFont(font_file_name, lazy=True)
+            scale = 1000.0 / font["head"].unitsPerEm
+            advances = font["hmtx"].metrics
+            widths = {}
+            for code, glyph in font.getBestCmap().items():
+                widths[str(code)] = advances[glyph][0] * scale
+            metrics = {"version": FontMetrics.VERSION, "stamp": stamp,
+              "family": font["name"].getDebugName(1),
+              "widths": widths,
+              "default_width": advances[font.getGlyphOrder()[0]][0] * scale}
+            font.close()
+            try:
+                if not os.path.isdir(cache_directory):
+                    os.makedirs(cache_directory)
+                file_replace(cache_file_name,
+                  json.dumps(metrics).encode("utf-8"))
+            except (IOError, OSError):
+                pass
+
+        widths = {}
+        for code, width in metrics["widths"].items():
+            widths[int(code)] = float(width)
+        return FontMetrics(native_str(metrics["family"]), widths,
+          float(metrics["default_width"]))
+
+# Labels are measured with these metrics.  They start out as the built in
+# Helvetica widths (which the SVG pages approximate with sans-serif), and
+# --font replaces them:
+font_metrics = FontMetrics("sans-serif", dict([(code + 32,
+  float(HELVETICA_WIDTHS[code])) for code in range(len(HELVETICA_WIDTHS))]),
+  556.0)
+
+def lines_fit(lines, rows, room):
+    """ Fit *lines* into at most *rows* rows, each of which may be *room*
+        millimeters long, and return a (*fitted*, *overflows*) tuple.
+        *fitted* is a list of (*text*, *font_size*) rows and *overflows* is
+        a list of the lines that do not fit even at the smallest font size.
+        A line that is too long is wrapped onto a spare row if possible and
+        is otherwise shrunk. """
+    fitted = []
+    overflows = []
+    spare = rows - len(lines)
+    for line in lines:
+        width = font_metrics.width(line) * FONT_SIZE
+        if width <= room:
+            fitted.append((line, FONT_SIZE))
+            continue
+
+        # Wrap it at spaces if that fits in the spare rows:
+        if spare > 0:
+            wrapped = []
+            for word in line.split(" "):
+                if wrapped and font_metrics.width(wrapped[-1] + " " + word) * \
+                  FONT_SIZE <= room:
+                    wrapped[-1] += " " + word
+                else:
+                    wrapped.append(word)
+            if len(wrapped) - 1 <= spare and max([font_metrics.width(row)
+              for row in wrapped]) * FONT_SIZE <= room:
+                for row in wrapped:
+                    fitted.append((row, FONT_SIZE))
+                spare -= len(wrapped) - 1
+                continue
+
+        # Otherwise shrink it:
+        font_size = FONT_SIZE * room / width
+        if font_size < FONT_SIZE * MINIMUM_FONT_SCALE:
+            font_size = FONT_SIZE * MINIMUM_FONT_SCALE
+            overflows.append(line)
+        fitted.append((line, font_size))
+    return fitted, overflows
+
+def text_unicode(text):
+    """ Return *text* (either UTF-8 bytes or unicode) as unicode. """
+    if isinstance(text, bytes):
+        return text.decode("utf-8")
+    return text
+
+def winansi_str(text):
+    """ Return *text* as a native *str* holding one character per byte of
+        its WinAnsi (cp1252) encoding, ready for a PDF string.  Raises
+        *UnicodeError* for characters that WinAnsi does not have. """
+    encoded = text_unicode(text).encode("cp1252")
+    if str is bytes:
+        return encoded
+    return encoded.decode("latin-1")
+
+def pdf_bytes(text):
+    """ Return *text* as PDF bytes (latin-1 encoded). """
+    if isinstance(text, bytes):
+        return text
+    return text.encode("latin-1")
+
+def file_replace(file_name, data):
+    """ Replace *file_name* with the bytes *data*.  The bytes go into a
+        temporary file that is then renamed into place, so readers never
+        see a partially written file. """
+    temporary_file_name = "{0}.{1}.tmp".format(file_name, os.getpid())
+    out_file = open(temporary_file_name, "wb")
+    out_file.write(data)
+    out_file.close()
+    os.rename(temporary_file_name, file_name)
+
+# Bump this whenever page drawing changes so stale cached pages are ignored:
+PAGE_CACHE_VERSION = 3
+
+class PageCache:
+    def __init__(self, directory, maximum_size):
+        """ *PageCache*: Initialize a cache of finished PDF pages stored in
+            *directory* and holding at most *maximum_size* bytes. """
+        # Check argument types:
+        assert isinstance(directory, str)
+        assert isinstance(maximum_size, int)
+
+        # Load up *self*:
+        self._directory = directory
+        self._maximum_size = maximum_size
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+
+        # Remember the size and last use time of every cached page:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._entries = {}
+        for file_name in os.listdir(directory):
+            if file_name.endswith(".page"):
+                status = os.stat(os.path.join(directory, file_name))
+                self._entries[file_name[:-5]] = [status.st_mtime,
+                  status.st_size]
+
+    def path(self, digest):
+        """ *PageCache*: Return the file name that holds *digest*. """
+        return os.path.join(self._directory, digest + ".page")
+
+    def __contains__(self, digest):
+        """ *PageCache*: Return *True* if *digest* is cached, without
+            touching it.  Only a miss is counted here; a hit is counted by
+            the *get* that follows. """
+        with self._lock:
+            if digest in self._entries:
+                return True
+            self._misses += 1
+            return False
+
+    def get(self, digest):
+        """ *PageCache*: Return the cached bytes for *digest* or *None*. """
+        # Check argument types:
+        assert isinstance(digest, str)
+
+        with self._lock:
+            data = None
+            if digest in self._entries:
+                try:
+                    in_file = open(self.path(digest), "rb")
+                    data = in_file.read()
+                    in_file.close()
+                    os.utime(self.path(digest), None)
+                    self._entries[digest][0] = time.time()
+                except (IOError, OSError):
+                    del self._entries[digest]
+                    data = None
+            if data is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+            return data
+
+    def put(self, digest, data):
+        """ *PageCache*: Store *data* under *digest* and evict the least
+            recently used pages until *self* fits in its maximum size. """
+        # Check argument types:
+        assert isinstance(digest, str)
+        assert isinstance(data, bytes)
+
+        with self._lock:
+            file_replace(self.path(digest), data)
+            self._entries[digest] = [time.time(), len(data)]
+            self._stores += 1
+
+            # Evict the oldest pages:
+            entries = self._entries
+            total_size = sum([entry[1] for entry in entries.values()])
+            if total_size > self._maximum_size:
+                for old_digest in sorted(entries.keys(),
+                  key=lambda key: entries[key][0]):
+                    if total_size <= self._maximum_size:
+                        break
+                    try:
+                        os.remove(self.path(old_digest))
+                    except OSError:
+                        pass
+                    total_size -= entries[old_digest][1]
+                    del entries[old_digest]
+                    self._evictions += 1
+
+    def report(self):
+        """ *PageCache*: Return a summary of how well *self* did. """
+        with self._lock:
+            lookups = self._hits + self._misses
+            hit_rate = 0.0
+            if lookups > 0:
+                hit_rate = 100.0 * self._hits / lookups
+            size = sum([entry[1] for entry in self._entries.values()])
+            return ("Page cache '{0}': {1} hits, {2} misses ({3:.1f}% hit "
+              "rate), {4} stores, {5} evictions, {6} pages in {7} of {8} "
+              "bytes").format(self._directory, self._hits, self._misses,
+              hit_rate, self._stores, self._evictions, len(self._entries),
+              size, self._maximum_size)
+
+class Renderer:
+    """ *Renderer*: Base class for things that *Organizer* draws pages into.
+        A page comes from *page_begin*, is drawn into with *line*, *outline*
+        and *text*, is handed back with *page_end*, and *finish* returns the
+        output file names.  A *Renderer* with a *PageCache* is first offered
+        each page that *page_cached* finds through *page_reuse*. """
+
+    def __init__(self, cache=None):
+        """ *Renderer*: Initialize. """
+        # Check argument types:
+        assert cache is None or isinstance(cache, PageCache)
+
+        # Load up *self*:
+        self._cache = cache
+
+    def characters_add(self, text):
+        """ *Renderer*: Note that the characters of *text* will be drawn
+            before any page is begun. """
+        pass
+
+    def page_cached(self, digest):
+        """ *Renderer*: Return *True* if *page_reuse* may find the page whose
+            content hashes to *digest*. """
+        return False
+
+    def page_reuse(self, name, index, x_size, y_size, digest):
+        """ *Renderer*: Return *True* if the page whose content hashes to
+            *digest* was produced from the cache and need not be drawn. """
+        return False
+
+    def page_begin(self, name, index, x_size, y_size, digest=None):
+        """ *Renderer*: Start page *index* of organizer *name* that is
+            *x_size* by *y_size* millimeters and return it. """
+        raise NotImplementedError
+
+    def page_end(self, page):
+        """ *Renderer*: Finish *page*. """
+        raise NotImplementedError
+
+    def finish(self):
+        """ *Renderer*: Write out all of the pages and return the list of
+            output (usually PDF) file names. """
+        raise NotImplementedError
+
+class SvgPage:
+    def __init__(self, file_name, x_size, y_size):
+        """ *SvgPage*: Initialize a page that streams its elements straight
+            into the SVG file *file_name* as they are drawn. """
+        # Check argument types:
+        assert isinstance(file_name, str)
+        assert isinstance(x_size, float)
+        assert isinstance(y_size, float)
+
+        # Load up *self*; everything on the page goes into one group that
+        # carries the font attributes for all of the labels:
+        self._out_file = open(file_name, "wb", 65536)
+        self._templates = {}
+        self._write(('<?xml version="1.0" encoding="utf-8" ?>\n'
+          '<svg baseProfile="tiny" width="{0}mm" height="{1}mm" '
+          'version="1.2" viewBox="0 0 {0} {1}" '
+          'xmlns="http://www.w3.org/2000/svg" '
+          'xmlns:xlink="http://www.w3.org/1999/xlink">\n'
+          '<g fill="black" font-family="{2}" font-size="1.2mm" '
+          'text-anchor="middle">\n').format(x_size, y_size,
+          xml.sax.saxutils.escape(font_metrics._family, {'"': "&quot;"})))
+
+    def _write(self, text):
+        """ *SvgPage*: Append *text* to the SVG file. """
+        self._out_file.write(utf8_bytes(text))
+
+    def line(self, x1, y1, x2, y2):
+        """ *SvgPage*: Draw a line from (*x1*, *y1) to (*x2*, *y2). """
+        self._write('<line stroke="black" stroke-width=".1mm" x1="{0:.3f}" '
+          'y1="{1:.3f}" x2="{2:.3f}" y2="{3:.3f}" />\n'.format(x1, y1, x2, y2))
+
+    def outline(self, segments, x_origin, y_origin):
+        """ *SvgPage*: Draw the (*x1*, *y1*, *x2*, *y2*) line *segments*
+            moved to (*x_origin*, *y_origin*).  Each distinct set of
+            *segments* is defined once and then placed with <use>. """
+        template = self._templates.get(segments)
+        if template is None:
+            template = "outline{0}".format(len(self._templates))
+            lines = ['<defs><g id="{0}" stroke="black" '
+              'stroke-width=".1mm">'.format(template)]
+            for x1, y1, x2, y2 in segments:
+                lines.append('<line x1="{0:.3f}" y1="{1:.3f}" x2="{2:.3f}" '
+                  'y2="{3:.3f}" />'.format(x1, y1, x2, y2))
+            lines.append('</g></defs>\n')
+            self._write("".join(lines))
+            self._templates[segments] = template
+        self._write('<use xlink:href="#{0}" x="{1:.3f}" y="{2:.3f}" />\n'.
+          format(template, x_origin, y_origin))
+
+    def text(self, label, x, y, font_size=FONT_SIZE):
+        """ *SvgPage*: Draw *label* at (*x*, *y*) *font_size* millimeters
+            tall: """
+        size = ""
+        if font_size != FONT_SIZE:
+            size = ' font-size="{0:.3f}"'.format(font_size)
+        self._write('<text{3} transform="rotate(-90 {0:.3f} {1:.3f})" '
+          'x="{0:.3f}" y="{1:.3f}">{2}</text>\n'.format(x, y,
+          xml.sax.saxutils.escape(label), size))
+
+    def save(self):
+        """ *SvgPage*: Finish off the SVG file. """
+        self._write("</g>\n</svg>\n")
+        self._out_file.close()
+
+class ValidatingSvgPage:
+    def __init__(self, file_name, x_size, y_size):
+        """ *ValidatingSvgPage*: Initialize a page that builds its elements
+            with *svgwrite*, which checks each of them against the SVG Tiny
+            profile.  This is much slower than *SvgPage* and is only meant
+            for checking the output. """
+        # Check argument types:
+        assert isinstance(file_name, str)
+        assert isinstance(x_size, float)
+        assert isinstance(y_size, float)
+
+        # Only validation needs *svgwrite*, so it is imported here rather
+        # than slowing down every import of this module:
+        import svgwrite
+
+        # Create the SVG *drawing*.  All of the labels go into one group
+        # that carries the font attributes for every one of them:
+        drawing = svgwrite.Drawing(file_name,
+          size = ("{0}mm".format(x_size), "{0}mm".format(y_size)),
+          viewBox = "0 0 {0} {1}".format(x_size, y_size), profile="tiny",
+          debug=True)
+        labels = drawing.g(font_family=font_metrics._family,
+          font_size="1.2mm",
+          fill="black", text_anchor="middle")
+        drawing.add(labels)
+        self._drawing = drawing
+        self._labels = labels
+        self._templates = {}
+
+    def line(self, x1, y1, x2, y2):
+        """ *ValidatingSvgPage*: Draw a line from (*x1*, *y1) to (*x2*, *y2). """
+        drawing = self._drawing
+        drawing.add(drawing.line((x1, y1), (x2, y2),
+          stroke="black", stroke_width = ".1mm"))
+
+    def outline(self, segments, x_origin, y_origin):
+        """ *ValidatingSvgPage*: Draw the (*x1*, *y1*, *x2*, *y2*) line *segments*
+            moved to (*x_origin*, *y_origin*).  Each distinct set of
+            *segments* is defined once in <defs> and placed with <use>. """
+        drawing = self._drawing
+        template = self._templates.get(segments)
+        if template is None:
+            template = "outline{0}".format(len(self._templates))
+            group = drawing.g(id=template, stroke="black", stroke_width=".1mm")
+            for x1, y1, x2, y2 in segments:
+                group.add(drawing.line((x1, y1), (x2, y2)))
+            drawing.defs.add(group)
+            self._templates[segments] = template
+        drawing.add(drawing.use("#" + template, insert=(x_origin, y_origin)))
+
+    def text(self, label, x, y, font_size=FONT_SIZE):
+        """ *ValidatingSvgPage*: Draw *label* at (*x*, *y*) *font_size*
+            millimeters tall: """
+        drawing = self._drawing
+        text = drawing.text(label, insert = (x, y),
+          transform="rotate(-90 {0} {1})".format(x, y))
+        if font_size != FONT_SIZE:
+            text["font-size"] = font_size
+        self._labels.add(text)
+
+    def save(self):
+        """ *ValidatingSvgPage*: Write *self* out to its file. """
+        self._drawing.save()
+
+def file_stem(name):
+    """ Return organizer *name* with everything but letters, digits, '-'
+        and '_' replaced by '_', so that it is safe in a file name that is
+        handed to other programs. """
+    return "".join([character if (character.isalnum() and
+      ord(character) < 128) or character in "-_" else "_"
+      for character in name])
+
+class SvgRenderer(Renderer):
+    def __init__(self, converter, cache=None, directory=".", validate=False):
+        """ *SvgRenderer*: Initialize a renderer that keeps its SVG and PDF
+            page files in *directory*.  If *validate* is *True*, the pages
+            are built with *svgwrite* so that every element is checked. """
+        # Check argument types:
+        assert isinstance(converter, InkscapeConverter)
+        assert isinstance(directory, str)
+        assert isinstance(validate, bool)
+
+        # Load up *self*:
+        Renderer.__init__(self, cache)
+        self._converter = converter
+        self._directory = directory
+        self._validate = validate
+        self._pdf_file_names = []
+        self._svg_file_names = []
+        self._converted_file_names = []
+        self._digests = []
+        self._page_indices = {}
+        self._conversions = None
+
+    def pdf_file_name_next(self, name):
+        """ *SvgRenderer*: Return the PDF file name for the next page. """
+        # Number pages across the whole run so organizers sharing a name
+        # do not overwrite each other:
+        pdf_file_name = os.path.join(self._directory,
+          "{0}{1}.pdf".format(file_stem(name), len(self._pdf_file_names)))
+        self._pdf_file_names.append(pdf_file_name)
+        return pdf_file_name
+
+    def page_cached(self, digest):
+        """ *SvgRenderer*: Return *True* if the page is in the cache. """
+        return self._cache is not None and "svg-" + digest in self._cache
+
+    def page_reuse(self, name, index, x_size, y_size, digest):
+        """ *SvgRenderer*: Copy a previously converted page out of the
+            cache. """
+        cache = self._cache
+        if cache is None:
+            return False
+        data = cache.get("svg-" + digest)
+        if data is None:
+            return False
+        out_file = open(self.pdf_file_name_next(name), "wb")
+        out_file.write(data)
+        out_file.close()
+        return True
+
+    def page_begin(self, name, index, x_size, y_size, digest=None):
+        """ *SvgRenderer*: Start an SVG page. """
+        pdf_file_name = self.pdf_file_name_next(name)
+        svg_file_name = pdf_file_name[:-4] + ".svg"
+        self._svg_file_names.append(svg_file_name)
+        self._converted_file_names.append(pdf_file_name)
+        self._digests.append(digest)
+        if self._validate:
+            page = ValidatingSvgPage(svg_file_name, x_size, y_size)
+        else:
+            page = SvgPage(svg_file_name, x_size, y_size)
+        self._page_indices[page] = len(self._svg_file_names) - 1
+        return page
+
+    def page_end(self, page):
+        """ *SvgRenderer*: Write the SVG *page* out and queue it to be
+            converted while the following pages are drawn. """
+        page.save()
+        if self._conversions is None:
+            workers = self._converter._workers
+            self._conversions = PipelineStage(self.page_convert, workers,
+              2 * workers)
+        self._conversions.put(self._page_indices.pop(page))
+
+    def page_convert(self, index):
+        """ *SvgRenderer*: Convert the *index*'th SVG page to PDF. """
+        svg_file_name = self._svg_file_names[index]
+        self._converter.convert(svg_file_name,
+          self._converted_file_names[index])
+        os.remove(svg_file_name)
+
+    def finish(self):
+        """ *SvgRenderer*: Convert all of the pages to pdf (in page order)
+            and clean up. """
+        # Wait for the conversions that are still going:
+        if self._conversions is not None:
+            with profiler.stage("convert"):
+                try:
+                    self._conversions.close()
+                finally:
+                    self._conversions = None
+
+        # Remember the freshly converted pages for next time:
+        self.pages_cache()
+
+        pdf_file_names = self._pdf_file_names
+        self._pdf_file_names = []
+        self._svg_file_names = []
+        self._converted_file_names = []
+        self._digests = []
+        self._page_indices = {}
+        return pdf_file_names
+
+    def pages_cache(self):
+        """ *SvgRenderer*: Put every page converted so far into the cache.
+        """
+        cache = self._cache
+        if cache is not None:
+            converted_file_names = self._converted_file_names
+            for index in range(len(converted_file_names)):
+                digest = self._digests[index]
+                if digest is not None and \
+                  os.path.exists(converted_file_names[index]):
+                    in_file = open(converted_file_names[index], "rb")
+                    cache.put("svg-" + digest, in_file.read())
+                    in_file.close()
+
+class PdfPage:
+    def __init__(self, x_size, y_size):
+        """ *PdfPage*: Initialize. """
+        # Check argument types:
+        assert isinstance(x_size, float)
+        assert isinstance(y_size, float)
+
+        # Load up *self*; the page is in millimeters with *y* increasing
+        # downwards like the SVG, but PDF wants points with *y* upwards:
+        self._x_size = x_size
+        self._y_size = y_size
+        self._scale = 72.0 / 25.4
+        self._operations = ["{0:.4f} w".format(.1 * self._scale)]
+
+    def line(self, x1, y1, x2, y2):
+        """ *PdfPage*: Draw a line from (*x1*, *y1) to (*x2*, *y2). """
+        scale = self._scale
+        y_size = self._y_size
+        self._operations.append("{0:.3f} {1:.3f} m {2:.3f} {3:.3f} l S".format(
+          x1 * scale, (y_size - y1) * scale, x2 * scale, (y_size - y2) * scale))
+
+    def outline(self, segments, x_origin, y_origin):
+        """ *PdfPage*: Draw the (*x1*, *y1*, *x2*, *y2*) line *segments*
+            moved to (*x_origin*, *y_origin*). """
+        for x1, y1, x2, y2 in segments:
+            self.line(x_origin + x1, y_origin + y1,
+              x_origin + x2, y_origin + y2)
+
+    def text(self, label, x, y, font_size=FONT_SIZE):
+        """ *PdfPage*: Draw *label* *font_size* millimeters tall centered on
+            (*x*, *y*) reading upwards. """
+        # Measure *label* so that it can be centered:
+        width = font_metrics.width(label) * font_size
+
+        # Rotate the text matrix a quarter turn so the baseline runs upwards:
+        scale = self._scale
+        escaped = winansi_str(label).replace("\\", "\\\\").replace(
+          "(", "\\(").replace(")", "\\)")
+        self._operations.append(
+          "BT /F1 {0:.3f} Tf 0 1 -1 0 {1:.3f} {2:.3f} Tm ({3}) Tj ET".format(
+          font_size * scale, x * scale,
+          (self._y_size - y - width / 2.0) * scale, escaped))
+
+    def content(self):
+        """ *PdfPage*: Return the page content stream. """
+        return "\n".join(self._operations)
+
+class PdfFont:
+    def __init__(self, file_name, cache=None):
+        """ *PdfFont*: Initialize a TrueType font from *file_name* that is
+            embedded once in each PDF file.  When *fontTools* is available
+            only the characters passed to *characters_add* are embedded, and
+            these subsets are kept in the *PageCache* *cache*. """
+        # Check argument types:
+        assert isinstance(file_name, str)
+        assert cache is None or isinstance(cache, PageCache)
+
+        # Only TrueType outlines can be embedded as "FontFile2":
+        in_file = open(file_name, "rb")
+        version = in_file.read(4)
+        in_file.close()
+        if version not in (b"\x00\x01\x00\x00", b"true"):
+            raise ValueError("{0}: PDF output needs a TrueType font".format(
+              file_name))
+
+        # Load up *self*:
+        self._file_name = os.path.abspath(file_name)
+        self._cache = cache
+        self._characters = set()
+
+    def characters_add(self, text):
+        """ *PdfFont*: Note that the characters of *text* are used. """
+        self._characters.update(text_unicode(text))
+
+    def data(self):
+        """ *PdfFont*: Return the TrueType font data to embed. """
+        characters = "".join(sorted(self._characters))
+        status = os.stat(self._file_name)
+        digest = hashlib.sha1(utf8_bytes(json.dumps([self._file_name,
+          status.st_mtime, status.st_size, characters]))).hexdigest()
+        cache = self._cache
+        if cache is not None:
+            data = cache.get("font-" + digest)
+            if data is not None:
+                return data
+
+        # Without *fontTools* the whole font is embedded:
+        try:
+            from fontTools import subset
+        except ImportError:
+            in_file = open(self._file_name, "rb")
+            data = in_file.read()
+            in_file.close()
+            return data
+
+        with profiler.stage("font.subset"):
+            # Only report real trouble from the subsetter:
+            logging.getLogger("fontTools").setLevel(logging.ERROR)
+            options = subset.Options()
+            options.notdef_outline = True
+            options.layout_features = []
+            font = subset.load_font(self._file_name, options)
+            subsetter = subset.Subsetter(options)
+            subsetter.populate(unicodes=[ord(character)
+              for character in characters])
+            subsetter.subset(font)
+            out_file = io.BytesIO()
+            subset.save_font(font, out_file, options)
+            font.close()
+            data = out_file.getvalue()
+        if cache is not None:
+            cache.put("font-" + digest, data)
+        return data
+
+    def objects_write(self, document, number):
+        """ *PdfFont*: Write the font out to *document* as object *number*
+            along with its descriptor and data. """
+        data = self.data()
+
+        # Pull the few metrics that the descriptor needs out of the "head"
+        # and "hhea" tables:
+        tables = {}
+        table_count = struct.unpack(">H", data[4:6])[0]
+        for index in range(table_count):
+            tag, check_sum, offset, length = struct.unpack(">4sIII",
+              data[12 + 16 * index:28 + 16 * index])
+            tables[tag] = offset
+        if b"head" not in tables or b"hhea" not in tables:
+            raise ValueError("{0}: not a TrueType font".format(
+              self._file_name))
+        head = tables[b"head"]
+        units = float(struct.unpack(">H", data[head + 18:head + 20])[0])
+        bounds = [int(value * 1000.0 / units) for value in
+          struct.unpack(">hhhh", data[head + 36:head + 44])]
+        hhea = tables[b"hhea"]
+        ascent, descent = [int(value * 1000.0 / units) for value in
+          struct.unpack(">hh", data[hhea + 4:hhea + 8])]
+
+        # Subset fonts get a tag that is unique to their characters:
+        tag = "".join([chr(ord("A") + ord(character) % 26) for character in
+          hashlib.sha1(data).hexdigest()[:6]])
+        name = "{0}+{1}".format(tag, "".join([character
+          for character in font_metrics._family if character.isalnum()]))
+        widths = []
+        for code in range(32, 256):
+            # The widths are by unicode character, the PDF codes WinAnsi:
+            try:
+                character = struct.pack("B", code).decode("cp1252")
+            except UnicodeError:
+                widths.append(font_metrics._default_width)
+            else:
+                widths.append(font_metrics._widths.get(ord(character),
+                  font_metrics._default_width))
+
+        descriptor = document._next_object
+        document._next_object += 2
+        document.object_write(number, ("<< /Type /Font /Subtype /TrueType "
+          "/BaseFont /{0} /FirstChar 32 /LastChar 255 /Widths [{1}] "
+          "/Encoding /WinAnsiEncoding /FontDescriptor {2} 0 R >>").format(
+          name, " ".join(["{0:.0f}".format(width) for width in widths]),
+          descriptor))
+        document.object_write(descriptor, ("<< /Type /FontDescriptor "
+          "/FontName /{0} /Flags 32 /FontBBox [{1}] /ItalicAngle 0 "
+          "/Ascent {2} /Descent {3} /CapHeight {2} /StemV 80 "
+          "/FontFile2 {4} 0 R >>").format(name,
+          " ".join([str(value) for value in bounds]), ascent, descent,
+          descriptor + 1))
+        compressed = zlib.compress(data)
+        document.object_write(descriptor + 1, pdf_bytes(("<< /Length {0} "
+          "/Length1 {1} /Filter /FlateDecode >>\nstream\n").format(
+          len(compressed), len(data))) + compressed + pdf_bytes("\nendstream"))
+
+class PdfDocument:
+    def __init__(self, file_name, font=None):
+        """ *PdfDocument*: Initialize and write out the document header.
+            The text is in the *PdfFont* *font*, or in Helvetica if *None*.
+        """
+        # Check argument types:
+        assert isinstance(file_name, str)
+        assert font is None or isinstance(font, PdfFont)
+
+        # Load up *self*.  Objects 1-3 are the catalog, the page tree and the
+        # font, which are written last; pages are numbered from 4 on as
+        # they arrive:
+        self._file_name = file_name
+        self._font = font
+        self._out_file = open(file_name, "wb")
+        self._offsets = {}
+        self._page_objects = []
+        self._next_object = 4
+
+        self._out_file.write(pdf_bytes("%PDF-1.4\n"))
+
+    def object_write(self, number, body):
+        """ *PdfDocument*: Append object *number* with *body* to the file. """
+        out_file = self._out_file
+        self._offsets[number] = out_file.tell()
+        out_file.write(pdf_bytes("{0} 0 obj\n".format(number)))
+        out_file.write(pdf_bytes(body))
+        out_file.write(pdf_bytes("\nendobj\n"))
+
+    def content_add(self, x_size, y_size, content):
+        """ *PdfDocument*: Write a *x_size* by *y_size* millimeter page with
+            the compressed *content* stream out to the end of *self*. """
+        # Check argument types:
+        assert isinstance(x_size, float)
+        assert isinstance(y_size, float)
+        assert isinstance(content, bytes)
+
+        # Only the page object number is remembered; the page itself can
+        # be dropped as soon as it has been written:
+        page_object = self._next_object
+        self._next_object += 2
+        self._page_objects.append(page_object)
+
+        scale = 72.0 / 25.4
+        self.object_write(page_object, ("<< /Type /Page /Parent 2 0 R "
+          "/MediaBox [0 0 {0:.3f} {1:.3f}] "
+          "/Resources << /Font << /F1 3 0 R >> >> "
+          "/Contents {2} 0 R >>").format(x_size * scale,
+          y_size * scale, page_object + 1))
+        self.object_write(page_object + 1,
+          pdf_bytes("<< /Length {0} /Filter /FlateDecode >>\nstream\n".format(
+          len(content))) + content + pdf_bytes("\nendstream"))
+
+    def close(self):
+        """ *PdfDocument*: Write out the page tree, catalog and cross
+            reference table and close the file. """
+        # Every page shares the one font:
+        if self._font is None:
+            self.object_write(3, "<< /Type /Font /Subtype /Type1 "
+              "/BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        else:
+            self._font.objects_write(self, 3)
+
+        page_objects = self._page_objects
+        self.object_write(2, "<< /Type /Pages /Kids [{0}] /Count {1} >>".format(
+          " ".join(["{0} 0 R".format(number) for number in page_objects]),
+          len(page_objects)))
+        self.object_write(1, "<< /Type /Catalog /Pages 2 0 R >>")
+
+        out_file = self._out_file
+        offsets = self._offsets
+        size = self._next_object
+        xref_offset = out_file.tell()
+        out_file.write(pdf_bytes(
+          "xref\n0 {0}\n0000000000 65535 f \n".format(size)))
+        for number in range(1, size):
+            out_file.write(pdf_bytes("{0:010d} 00000 n \n".format(
+              offsets[number])))
+        out_file.write(pdf_bytes("trailer\n<< /Size {0} /Root 1 0 R >>\n"
+          "startxref\n{1}\n%%EOF\n".format(size, xref_offset)))
+        out_file.close()
+
+class PdfRenderer(Renderer):
+    def __init__(self, file_name, cache=None, font_file_name=None):
+        """ *PdfRenderer*: Initialize a renderer that writes *file_name*,
+            embedding the TrueType font *font_file_name* if given. """
+        # Check argument types:
+        assert isinstance(file_name, str)
+        assert font_file_name is None or isinstance(font_file_name, str)
+
+        # Load up *self*; the document is opened by the first page:
+        Renderer.__init__(self, cache)
+        self._file_name = file_name
+        self._document = None
+        self._digests = {}
+        self._font = None
+        if font_file_name is not None:
+            self._font = PdfFont(font_file_name, cache)
+
+    def characters_add(self, text):
+        """ *PdfRenderer*: Note that the characters of *text* are used. """
+        if self._font is not None:
+            self._font.characters_add(text)
+
+    def document(self):
+        """ *PdfRenderer*: Return the document, opening it if need be. """
+        if self._document is None:
+            self._document = PdfDocument(self._file_name, self._font)
+        return self._document
+
+    def page_cached(self, digest):
+        """ *PdfRenderer*: Return *True* if the page is in the cache. """
+        return self._cache is not None and "pdf-" + digest in self._cache
+
+    def page_reuse(self, name, index, x_size, y_size, digest):
+        """ *PdfRenderer*: Copy a previously drawn content stream out of the
+            cache. """
+        cache = self._cache
+        if cache is None:
+            return False
+        content = cache.get("pdf-" + digest)
+        if content is None:
+            return False
+        self.document().content_add(x_size, y_size, content)
+        return True
+
+    def page_begin(self, name, index, x_size, y_size, digest=None):
+        """ *PdfRenderer*: Start a PDF page. """
+        page = PdfPage(x_size, y_size)
+        self._digests[page] = digest
+        return page
+
+    def page_end(self, page):
+        """ *PdfRenderer*: Stream *page* into the document. """
+        content = zlib.compress(pdf_bytes(page.content()))
+        self.document().content_add(page._x_size, page._y_size, content)
+        digest = self._digests.pop(page)
+        if self._cache is not None and digest is not None:
+            self._cache.put("pdf-" + digest, content)
+
+    def finish(self):
+        """ *PdfRenderer*: Finish the single multi-page document. """
+        file_names = []
+        if self._document is not None:
+            with profiler.stage("pdf.close"):
+                self._document.close()
+            self._document = None
+            file_names.append(self._file_name)
+        return file_names
+
+# A 5 by 7 bitmap font for the printable ASCII characters, from space to
+# tilde.  Each character is five column bytes, left to right, with the top
+# row in the low bit:
+GLYPHS_5X7 = (
+  "0000000000", "00005f0000", "0007000700", "147f147f14", "242a7f2a12",
+  "2313086462", "3649552250", "0005030000", "001c224100", "0041221c00",
+  "142a1c2a14", "08083e0808", "0050300000", "0808080808", "0060600000",
+  "2010080402", "3e5149453e", "00427f4000", "4261514946", "2141454b31",
+  "1814127f10", "2745454539", "3c4a494930", "0171090503", "3649494936",
+  "064949291e", "0036360000", "0056360000", "0814224100", "1414141414",
+  "0041221408", "0201510906", "324979413e", "7e1111117e", "7f49494936",
+  "3e41414122", "7f4141221c", "7f49494941", "7f09090101", "3e41415132",
+  "7f0808087f", "00417f4100", "2040413f01", "7f08142241", "7f40404040",
+  "7f0204027f", "7f0408107f", "3e4141413e", "7f09090906", "3e4151215e",
+  "7f09192946", "4649494931", "01017f0101", "3f4040403f", "1f2040201f",
+  "7f2018207f", "6314081463", "0304780403", "6151494543", "00007f4141",
+  "0204081020", "41417f0000", "0402010204", "4040404040", "0001020400",
+  "2054545478", "7f48444438", "3844444420", "384444487f", "3854545418",
+  "087e090102", "0c5252523e", "7f08040478", "00447d4000", "2040443d00",
+  "007f102844", "00417f4000", "7c04180478", "7c08040478", "3844444438",
+  "7c14141408", "081414187c", "7c08040408", "4854545420", "043f444020",
+  "3c4040207c", "1c2040201c", "3c4030403c", "4428102844", "0c5050503c",
+  "4464544c44", "0008364100", "00007f0000", "0041360800", "0804081008")
+
+class RasterPage:
+    def __init__(self, renderer, x_size, y_size):
+        """ *RasterPage*: Initialize an *x_size* by *y_size* millimeter
+            bitmap page for the *RasterRenderer* *renderer*. """
+        # Check argument types:
+        assert isinstance(renderer, RasterRenderer)
+        assert isinstance(x_size, float)
+        assert isinstance(y_size, float)
+
+        # Load up *self*; the bitmap is indexed by [*row*, *column*] with
+        # *True* for black:
+        self._renderer = renderer
+        self._x_size = x_size
+        self._y_size = y_size
+        self._scale = renderer._dpi / 25.4
+        self._bits = renderer._numpy.zeros((self.pixel(y_size),
+          self.pixel(x_size)), dtype=renderer._numpy.bool_)
+        self._thickness = max(1, self.pixel(.1))
+
+    def pixel(self, millimeters):
+        """ *RasterPage*: Return *millimeters* as a whole number of pixels.
+        """
+        return int(round(millimeters * self._scale))
+
+    def line(self, x1, y1, x2, y2):
+        """ *RasterPage*: Draw a line from (*x1*, *y1) to (*x2*, *y2). """
+        bits = self._bits
+        if x1 == x2 or y1 == y2:
+            # Horizontal and vertical lines (all the outlines) are a single
+            # rectangle fill:
+            thickness = self._thickness
+            row1 = self.pixel(min(y1, y2))
+            column1 = self.pixel(min(x1, x2))
+            bits[row1:self.pixel(max(y1, y2)) + thickness,
+              column1:self.pixel(max(x1, x2)) + thickness] = True
+        else:
+            numpy = self._renderer._numpy
+            steps = max(abs(self.pixel(x2) - self.pixel(x1)),
+              abs(self.pixel(y2) - self.pixel(y1))) + 1
+            rows = numpy.rint(numpy.linspace(y1, y2, steps) *
+              self._scale).astype(int)
+            columns = numpy.rint(numpy.linspace(x1, x2, steps) *
+              self._scale).astype(int)
+            inside = (rows >= 0) & (rows < bits.shape[0]) & \
+              (columns >= 0) & (columns < bits.shape[1])
+            bits[rows[inside], columns[inside]] = True
+
+    def outline(self, segments, x_origin, y_origin):
+        """ *RasterPage*: Draw the (*x1*, *y1*, *x2*, *y2*) line *segments*
+            moved to (*x_origin*, *y_origin*). """
+        for x1, y1, x2, y2 in segments:
+            self.line(x_origin + x1, y_origin + y1,
+              x_origin + x2, y_origin + y2)
+
+    def text(self, label, x, y, font_size=FONT_SIZE):
+        """ *RasterPage*: Draw *label* *font_size* millimeters tall centered
+            on (*x*, *y*) reading upwards. """
+        if not label:
+            return
+
+        # The rotated glyphs sit to the left of the baseline at *x*:
+        glyphs = self._renderer.text_bits(label, font_size)
+        height, width = glyphs.shape
+        row = self.pixel(y) - height // 2
+        column = self.pixel(x) - width
+
+        # Clip the glyphs to the page and "or" them in:
+        bits = self._bits
+        row1 = max(row, 0)
+        row2 = min(row + height, bits.shape[0])
+        column1 = max(column, 0)
+        column2 = min(column + width, bits.shape[1])
+        if row1 < row2 and column1 < column2:
+            bits[row1:row2, column1:column2] |= \
+              glyphs[row1 - row:row2 - row, column1 - column:column2 - column]
+
+class RasterRenderer(Renderer):
+    # Pages are packed and written this many at a time:
+    BATCH_SIZE = 8
+
+    def __init__(self, file_name, format="pbm", dpi=203.0):
+        """ *RasterRenderer*: Initialize a renderer that draws 1-bit pages at
+            *dpi* dots per inch for thermal label printers and writes them
+            all to *file_name* in *format*.  *format* is "pbm" (one binary
+            PBM image per page), "png" (all of the pages stacked into one
+            tall image) or "raw" (the packed rows of every page back to
+            back, most significant bit first with 1 for black).  Needs
+            *NumPy*. """
+        # Check argument types:
+        assert isinstance(file_name, str)
+        assert format in ("pbm", "png", "raw")
+        assert isinstance(dpi, float)
+
+        # Only raster output needs *numpy*, so it is imported here rather
+        # than slowing down every import of this module:
+        import numpy
+
+        # Load up *self*:
+        Renderer.__init__(self)
+        self._numpy = numpy
+        self._file_name = file_name
+        self._format = format
+        self._dpi = dpi
+        self._batch = []
+        self._out_file = None
+        self._png_chunks = []
+        self._png_compressor = None
+        self._png_size = None
+        self._text_bits = {}
+
+        # Unpack the glyphs into a (character, row, column) atlas with a
+        # blank spacing column after each one:
+        atlas = numpy.zeros((len(GLYPHS_5X7), 7, 6), dtype=numpy.bool_)
+        for index in range(len(GLYPHS_5X7)):
+            columns = bytearray.fromhex(GLYPHS_5X7[index])
+            for column in range(5):
+                for row in range(7):
+                    atlas[index, row, column] = (columns[column] >> row) & 1
+        self._atlas = atlas
+
+    def text_bits(self, label, font_size):
+        """ *RasterRenderer*: Return the bitmap of *label* *font_size*
+            millimeters tall, rotated to read upwards. """
+        # Labels repeat a lot, so remember the bitmaps already made:
+        key = (label, font_size)
+        bits = self._text_bits.get(key)
+        if bits is None:
+            numpy = self._numpy
+            unknown = ord("?") - 32
+            codes = [ord(character) - 32 for character in label]
+            codes = [code if 0 <= code < len(GLYPHS_5X7) else unknown
+              for code in codes]
+            strip = self._atlas[codes].transpose(1, 0, 2).reshape(7, -1)
+
+            # Stretch the glyphs to the capital height and the measured
+            # width so that they match the fitting and centering:
+            scale = self._dpi / 25.4
+            height = max(7, int(round(font_size * .72 * scale)))
+            width = max(1, int(round(font_metrics.width(label) * font_size *
+              scale)))
+            rows = numpy.arange(height) * 7 // height
+            columns = numpy.arange(width) * strip.shape[1] // width
+            bits = numpy.rot90(strip[rows[:, None], columns])
+            if len(self._text_bits) >= 10000:
+                self._text_bits.clear()
+            self._text_bits[key] = bits
+        return bits
+
+    def page_begin(self, name, index, x_size, y_size, digest=None):
+        """ *RasterRenderer*: Start a raster page. """
+        return RasterPage(self, x_size, y_size)
+
+    def page_end(self, page):
+        """ *RasterRenderer*: Queue *page* to be written. """
+        self._batch.append(page._bits)
+        if len(self._batch) >= RasterRenderer.BATCH_SIZE:
+            self.batch_write()
+
+    def batch_write(self):
+        """ *RasterRenderer*: Pack the queued pages and write them out. """
+        batch = self._batch
+        if not batch:
+            return
+        numpy = self._numpy
+        self._batch = []
+        pages = numpy.array(batch)
+        count, height, width = pages.shape
+        if self._format == "png":
+            # PNG gray is 0 for black, and every row starts with a filter
+            # type byte; the header is written once the height is known:
+            if self._png_compressor is None:
+                self._png_compressor = zlib.compressobj(9)
+                self._png_size = [width, 0]
+            rows = numpy.concatenate((numpy.zeros((count, height, 1),
+              dtype=numpy.uint8), numpy.packbits(~pages, axis=2)), axis=2)
+            self._png_chunks.append(self._png_compressor.compress(
+              rows.tobytes()))
+            self._png_size[1] += count * height
+            return
+
+        packed = numpy.packbits(pages, axis=2)
+        if self._out_file is None:
+            self._out_file = open(self._file_name, "wb")
+        out_file = self._out_file
+        if self._format == "raw":
+            out_file.write(packed.tobytes())
+        else:
+            for index in range(count):
+                out_file.write(pdf_bytes("P4\n{0} {1}\n".format(width,
+                  height)))
+                out_file.write(packed[index].tobytes())
+
+    def finish(self):
+        """ *RasterRenderer*: Write out the remaining pages and return the
+            output file name (if there were any pages). """
+        with profiler.stage("raster.write"):
+            self.batch_write()
+            file_names = []
+            if self._png_compressor is not None:
+                def chunk(kind, data):
+                    return (struct.pack(">I", len(data)) + kind + data +
+                      struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+                out_file = open(self._file_name, "wb")
+                out_file.write(b"\x89PNG\r\n\x1a\n")
+                out_file.write(chunk(b"IHDR", struct.pack(">IIBBBBB",
+                  self._png_size[0], self._png_size[1], 1, 0, 0, 0, 0)))
+                self._png_chunks.append(self._png_compressor.flush())
+                out_file.write(chunk(b"IDAT", b"".join(self._png_chunks)))
+                out_file.write(chunk(b"IEND", b""))
+                out_file.close()
+                self._png_chunks = []
+                self._png_compressor = None
+                file_names.append(self._file_name)
+            elif self._out_file is not None:
+                self._out_file.close()
+                self._out_file = None
+                file_names.append(self._file_name)
+        return file_names
+
+class Sheet:
+    def __init__(self, x_size=8 * 25.4, y_size=10 * 25.4, margin=3.0,
+      dense=False):
+        """ *Sheet*: Initialize an *x_size* by *y_size* millimeter sheet of
+            label stock with *margin* millimeters left around the edges.
+            When *dense* is set, drawer outlines are packed into as few
+            pages as possible; otherwise each organizer gets one column of
+            *labels_per_page* drawers per page. """
+        # Check argument types:
+        assert isinstance(x_size, float)
+        assert isinstance(y_size, float)
+        assert isinstance(margin, float)
+        assert isinstance(dense, bool)
+
+        # Load up *self*:
+        self._x_size = x_size
+        self._y_size = y_size
+        self._margin = margin
+        self._dense = dense
+
+    def pages_layout(self, extents, labels_per_page):
+        """ *Sheet*: Lay out outlines with the (*x_extent*, *y_extent*) sizes
+            in *extents*, in order, and return a list of pages, each a list
+            of (*index*, *x_origin*, *y_origin*) placements where *index*
+            refers back into *extents*. """
+        # Check argument types:
+        assert isinstance(extents, list)
+        assert isinstance(labels_per_page, int)
+
+        pages = []
+        margin = self._margin
+        if not self._dense:
+            # One column of *labels_per_page* outlines per page:
+            for start in range(0, len(extents), labels_per_page):
+                page = []
+                y_origin = margin
+                for index in range(start,
+                  min(start + labels_per_page, len(extents))):
+                    page.append((index, margin, y_origin))
+                    y_origin += extents[index][1]
+                pages.append(page)
+            return pages
+
+        # First fit shelf packing: each page is a stack of horizontal
+        # shelves and every outline goes onto the first shelf with room
+        # for it, opening a new shelf (or page) when none has room:
+        x_limit = self._x_size - margin
+        y_limit = self._y_size - margin
+        page = []
+        shelves = []
+        y_next = margin
+        for index in range(len(extents)):
+            x_extent, y_extent = extents[index]
+            placed = False
+            for shelf in shelves:
+                # A shelf is [*y_origin*, *height*, *x_next*]:
+                if y_extent <= shelf[1] and shelf[2] + x_extent <= x_limit:
+                    page.append((index, shelf[2], shelf[0]))
+                    shelf[2] += x_extent
+                    placed = True
+                    break
+            if not placed:
+                if y_next + y_extent > y_limit and page:
+                    pages.append(page)
+                    page = []
+                    shelves = []
+                    y_next = margin
+                # An outline bigger than the sheet still gets a page:
+                shelves.append([y_next, y_extent, margin + x_extent])
+                page.append((index, margin, y_next))
+                y_next += y_extent
+        if page:
+            pages.append(page)
+        return pages
 
 class Organizer:
     def __init__(self, name, length, width, height,
       font_height, front_rows, labels_per_page):
-	""" *Organizer*: Initialize. """
-
-	# Check argument types:
-	assert isinstance(name, str)
-	assert isinstance(length, float)
-	assert isinstance(width, float)
-	assert isinstance(height, float)
-	assert isinstance(font_height, float)
-	assert isinstance(front_rows, int)
-	assert isinstance(labels_per_page, int)
-
-	# Load up *self*:
-	self._name = name
-	self._length = length
-	self._width = width
-	self._height = height
-	self._font_height = font_height
-	self._front_rows = front_rows
-	self._table = {}
-	self._labels_per_page = labels_per_page
-	self._pending = []
-	self._drawing = None
-	self._inter_line = (height + font_height) / (front_rows + 1)
+        """ *Organizer*: Initialize. """
+
+        # Check argument types:
+        assert isinstance(name, str)
+        assert isinstance(length, float)
+        assert isinstance(width, float)
+        assert isinstance(height, float)
+        assert isinstance(font_height, float)
+        assert isinstance(front_rows, int)
+        assert isinstance(labels_per_page, int)
+
+        # Load up *self*:
+        self._name = name
+        self._length = length
+        self._width = width
+        self._height = height
+        self._font_height = font_height
+        self._front_rows = front_rows
+        self._table = {}
+        self._keys = []
+        self._strings = {}
+        self._labels_per_page = labels_per_page
+        self._pending = []
+        self._drawing = None
+        self._inter_line = (height + font_height) / (front_rows + 1)
+
+        # The labels run across the drawer width, the front ones in rows
+        # across its height and the bottom ones in rows across its length:
+        self._text_room = width - 2.0 * TEXT_MARGIN
+        self._bottom_rows = max(1,
+          int((length - font_height) / self._inter_line) + 1)
+
+        # The drawer outline relative to its upper left corner:
+        x2 = height
+        x3 = x2 + length
+        y3 = width
+        self._outline = (
+          (0.0, 0.0, x3, 0.0), (0.0, y3, x3, y3),
+          (0.0, 0.0, 0.0, y3), (x2, 0.0, x2, y3), (x3, 0.0, x3, y3))
 
     def drawer(self, key, front_labels, bottom_labels=[]):
-	""" *Organizer*: Create a new drawer. """
-	# Check argument types:
-	assert isinstance(key, str)
-	assert isinstance(front_labels, list)
-	assert isinstance(bottom_labels, list)
-
-	# Create *drawer* and stuff it into *self*:
-	drawer = Drawer(self, key, front_labels, bottom_labels)
-	self._table[key] = drawer
+        """ *Organizer*: Create a new drawer. """
+        # Check argument types:
+        if strict:
+            assert isinstance(key, str)
+            assert isinstance(front_labels, list)
+            assert isinstance(bottom_labels, list)
+
+        # Create *drawer* and stuff it into *self*:
+        drawer = Drawer(self, key, front_labels, bottom_labels)
+        if key not in self._table:
+            self._keys.append(key)
+        self._table[key] = drawer
 
     def draw(self, key):
-	""" *Organizer: Schedule *key* to be drawn. """
-	# Check argument types:
-	assert isinstance(key, str)
-
-	result = False
-	if key in self._table:
-	    self._pending.append(key)
-	    result = True
-	return result
-
-    def done(self):
-	""" *Organizer*. Cause all drawing to occur. """
-
-	# Group keys into *labels_per_page* chunks:
-	pending = self._pending
-	labels_per_page = self._labels_per_page
-	key_chunks = []
-	size = len(pending)
-	for index in range(0, size, labels_per_page):
-	    start = index
-	    end = index + labels_per_page
-	    if end > size:
-		end = size
-	    #print("start={0} end={1}".format(start, end))
-	    key_chunk = pending[start:end]
-	    key_chunks.append(key_chunk)
-	    #print("key_chunks[{0}:{1}]:{2}".format(start, end, key_chunk))
-	#print("key_chunks={0}".format(key_chunks))
-
-	file_names = []
-	for file_index in range(len(key_chunks)):
-	    key_chunk = key_chunks[file_index]
-	    x_size = 8 * 25.4
-	    y_size = 10 * 25.4
-	    svg_file_name = "{0}{1}.svg".format(self._name, file_index)
-	    pdf_file_name = "{0}{1}.pdf".format(self._name, file_index)
-
-	    # Create the SVG *drawing*:
-	    drawing = svgwrite.Drawing(svg_file_name,
-	      size = ("{0}mm".format(x_size), "{0}mm".format(y_size)),
-	      viewBox = "0 0 {0} {1}".format(x_size, y_size), profile="tiny")
-	    self._drawing = drawing
-
-	    for drawer_index in range(len(key_chunk)):
-		# Draw the outline:
-		key = key_chunk[drawer_index]
-		drawer = self._table[key]
-		assert isinstance(drawer, Drawer)
-		
-		# Draw the *drawer* at (*x_origin*, *y_origin*):
-		x_origin = 3.0
-		y_origin = 3.0 + drawer_index * self._width
-		self.drawer_draw(drawer, x_origin, y_origin)
-		#print("Drawer[{0}]:key={1}".format(drawer_index, drawer._key))
-
-	    # Cause the drawing to be written out:
-	    drawing.save()
-	    self._drawing = None
-
-	    # Convert to pdf:
-	    command = "inkscape -f {0} -A {1}".format(
-	      svg_file_name, pdf_file_name)
-	    #print("command='{0}'".format(command))
-	    try:
-		subprocess.check_call(command, shell=True)
-	    except subprocess.CalledProcessError as cpe:
-		print("Command '{0}' failed".format(command))
-            os.remove(svg_file_name)
-
-	    file_names.append(pdf_file_name)
-
-	return file_names
+        """ *Organizer: Schedule *key* to be drawn. """
+        # Check argument types:
+        assert isinstance(key, str)
+
+        result = False
+        if key in self._table:
+            self._pending.append(key)
+            result = True
+        return result
+
+    def done(self, renderer=None, sheet=None):
+        """ *Organizer*. Cause all drawing to occur. """
+        # Check argument types:
+        assert renderer is None or isinstance(renderer, Renderer)
+
+        # Default to SVG pages converted by *inkscape*:
+        if renderer is None:
+            renderer = SvgRenderer(InkscapeConverter())
+
+        self.pages_draw(renderer, sheet)
+        return renderer.finish()
+
+    def pages_draw(self, renderer, sheet=None):
+        """ *Organizer*: Draw all of the pending drawers as pages of
+            *renderer* laid out on *sheet*. """
+        # Check argument types:
+        assert isinstance(renderer, Renderer)
+        assert sheet is None or isinstance(sheet, Sheet)
+
+        # Lay out the pending drawer outlines:
+        if sheet is None:
+            sheet = Sheet()
+        pending = self._pending
+        extent = (self._height + self._length, self._width)
+        pages = sheet.pages_layout([extent] * len(pending),
+          self._labels_per_page)
+
+        pages_render(renderer, [[(self, pending[index], x_origin, y_origin)
+          for index, x_origin, y_origin in page] for page in pages], sheet)
+
+    def drawers_lines(self):
+        """ *Organizer*: Return a list of (*key*, *front_lines*,
+            *bottom_lines*) for every drawer of *self*, where the lines are
+            lists. """
+        table = self._table
+        if isinstance(table, CatalogTable):
+            return table._index.items()
+        drawers = []
+        for key in self._keys:
+            drawer = table[key]
+            drawers.append((key, list(drawer._front_lines),
+              list(drawer._bottom_lines)))
+        return drawers
+
+    def validate(self):
+        """ *Organizer*: Check the geometry and every drawer of *self* and
+            return a list of problems (empty if all is well). """
+        geometry = {"name": self._name, "length": self._length,
+          "width": self._width, "height": self._height,
+          "font_height": self._font_height, "front_rows": self._front_rows,
+          "labels_per_page": self._labels_per_page}
+        return catalog_validate("Organizer '{0}'".format(self._name),
+          geometry, self.drawers_lines())
 
     def line(self, x1, y1, x2, y2):
-	""" *Organizer*: Draw a line from (*x1*, *y1) to (*x2*, *y2). """
-	# Check argument types:
-	assert isinstance(x1, float)
-	assert isinstance(y1, float)
-	assert isinstance(x2, float)
-	assert isinstance(y2, float)
-
-	# Draw the line:
-	drawing = self._drawing
-	drawing.add(drawing.line((x1, y1), (x2, y2),
-	  stroke="black", stroke_width = ".1mm"))
-
-    def text(self, label, x, y):
-	""" *Organizer*: Draw *label* at (*x*, *y*): """
-
-	drawing = self._drawing
-	drawing.add(drawing.text(label, insert = (x, y),
-	  font_family="sans-serif", font_size="1.2mm", fill="black",
-	  text_anchor="middle", transform="rotate(-90 {0} {1})".format(x, y)))
+        """ *Organizer*: Draw a line from (*x1*, *y1) to (*x2*, *y2). """
+        # Check argument types:
+        if strict:
+            assert isinstance(x1, float)
+            assert isinstance(y1, float)
+            assert isinstance(x2, float)
+            assert isinstance(y2, float)
+
+        # Draw the line:
+        self._drawing.line(x1, y1, x2, y2)
+
+    def text(self, label, x, y, font_size=FONT_SIZE):
+        """ *Organizer*: Draw *label* at (*x*, *y*) *font_size* millimeters
+            tall: """
+
+        self._drawing.text(label, x, y, font_size)
+
+    def lines_fit(self, front_lines, bottom_lines):
+        """ *Organizer*: Return the (*front_fitted*, *bottom_fitted*,
+            *overflows*) that *lines_fit* gives for a drawer of *self* with
+            *front_lines* and *bottom_lines*. """
+        front_fitted, front_overflows = lines_fit(front_lines,
+          self._front_rows, self._text_room)
+        bottom_fitted, bottom_overflows = lines_fit(bottom_lines,
+          self._bottom_rows, self._text_room)
+        return front_fitted, bottom_fitted, front_overflows + bottom_overflows
 
     def drawer_draw(self, drawer, x_origin, y_origin):
-	""" Drawer: Draw a drawer into *drawing* """
-	# Check argument types:
-	assert isinstance(drawer, Drawer)
-	assert isinstance(x_origin, float)
-	assert isinstance(y_origin, float)
-
-	drawing = self._drawing
-
-	x1 = x_origin
-	x2 = x1 + self._height
-	x3 = x2 + self._length
-	y1 = y_origin
-	y2 = y1 + self._width/2
-	y3 = y2 + self._width/2
-
-        # Draw horizontal lines:
-	self.line(x1, y1, x3, y1)
-	self.line(x1, y3, x3, y3)
-
-	# Draw vertical lines:
-	self.line(x1, y1, x1, y3)
-	self.line(x2, y1, x2, y3)
-	self.line(x3, y1, x3, y3)
-
-	# Draw the labels:
-	font_height = self._font_height
-	inter_line = self._inter_line
-	line_height = font_height + inter_line
-
-	# Draw the front lines:
-	front_lines = drawer._front_lines
-	for line_index in range(len(front_lines)):
-	    front_line = front_lines[line_index]
-	    self.text(front_line,
-	      x1 + (line_index *inter_line) + font_height, y2)
-
-	# Draw the bottom lines:
-	bottom_lines = drawer._bottom_lines
-	for line_index in range(len(bottom_lines)):
-	    bottom_line = bottom_lines[line_index]
-	    self.text(bottom_line,
-	      x2 + (line_index *inter_line) + font_height, y2)
+        """ Drawer: Draw a drawer into *drawing* """
+        # Check argument types:
+        if strict:
+            assert isinstance(drawer, Drawer)
+            assert isinstance(x_origin, float)
+            assert isinstance(y_origin, float)
+
+        drawing = self._drawing
+
+        x1 = x_origin
+        x2 = x1 + self._height
+        y2 = y_origin + self._width/2
+
+        # Draw the horizontal and vertical lines:
+        drawing.outline(self._outline, x_origin, y_origin)
+
+        # Draw the labels, wrapped or shrunk to fit:
+        font_height = self._font_height
+        inter_line = self._inter_line
+        front_lines, bottom_lines, overflows = self.lines_fit(
+          drawer._front_lines, drawer._bottom_lines)
+
+        # Draw the front lines:
+        for line_index in range(len(front_lines)):
+            front_line, font_size = front_lines[line_index]
+            self.text(front_line,
+              x1 + (line_index *inter_line) + font_height, y2, font_size)
+
+        # Draw the bottom lines:
+        for line_index in range(len(bottom_lines)):
+            bottom_line, font_size = bottom_lines[line_index]
+            self.text(bottom_line,
+              x2 + (line_index *inter_line) + font_height, y2, font_size)
+
+def pages_render(renderer, pages, sheet):
+    """ Draw *pages*, each a list of (*organizer*, *key*, *x_origin*,
+        *y_origin*) placements, as *sheet* sized pages of *renderer*.  Each
+        drawer is drawn by its own organizer, so a page may mix organizers.
+    """
+    # Check argument types:
+    assert isinstance(renderer, Renderer)
+    assert isinstance(pages, list)
+    assert isinstance(sheet, Sheet)
+
+    # Tell the renderer every character that will be drawn, so that it
+    # can prepare its font once:
+    for placements in pages:
+        for organizer, key, x_origin, y_origin in placements:
+            drawer = organizer._table[key]
+            for line in drawer._front_lines + drawer._bottom_lines:
+                renderer.characters_add(line)
+
+    # Pages are drawn here while a second thread writes the finished ones
+    # out (and the renderer may convert them in yet more threads):
+    def page_save(drawing):
+        with profiler.stage("page.save"):
+            renderer.page_end(drawing)
+    saver = PipelineStage(page_save)
+    try:
+        x_size = sheet._x_size
+        y_size = sheet._y_size
+        for page_index, name, placements, digest in page_jobs(pages, sheet):
+            # Skip drawing pages that the renderer already has in its cache.
+            # They go straight into the output, so the pages before them
+            # are written out first; pages that are not cached keep the
+            # saver running alongside the drawing:
+            if renderer.page_cached(digest):
+                saver.drain()
+                with profiler.stage("page.reuse"):
+                    reused = renderer.page_reuse(name, page_index,
+                      x_size, y_size, digest)
+                if reused:
+                    profiler.count("pages.reused")
+                    continue
+
+            # Create the page *drawing*:
+            drawing = renderer.page_begin(name, page_index,
+              x_size, y_size, digest)
+
+            with profiler.stage("page.draw"):
+                for organizer, key, x_origin, y_origin in placements:
+                    # Draw the *drawer* at (*x_origin*, *y_origin*):
+                    drawer = organizer._table[key]
+                    organizer._drawing = drawing
+                    organizer.drawer_draw(drawer, x_origin, y_origin)
+                    organizer._drawing = None
+
+            # Cause the page to be written out:
+            saver.put(drawing)
+            profiler.count("pages.drawn")
+            profiler.count("drawers.drawn", len(placements))
+    finally:
+        saver.close()
+
+def page_jobs(pages, sheet):
+    """ Generate a (*page_index*, *name*, *placements*, *digest*) job for
+        each of the laid out *pages* of *sheet*, as *pages_render* is ready
+        for them. """
+    x_size = sheet._x_size
+    y_size = sheet._y_size
+    for page_index in range(len(pages)):
+        placements = pages[page_index]
+
+        # Name the page after its organizer unless it is shared:
+        names = set([organizer._name for organizer, key, x, y in placements])
+        name = "Mixed"
+        if len(names) == 1:
+            name = names.pop()
+        yield (page_index, name, placements,
+          page_digest(placements, x_size, y_size))
+
+def page_digest(placements, x_size, y_size):
+    """ Return a hash of everything that determines how an *x_size* by
+        *y_size* page with the (*organizer*, *key*, *x_origin*, *y_origin*)
+        *placements* looks. """
+    # Check argument types:
+    assert isinstance(placements, list)
+    assert isinstance(x_size, float)
+    assert isinstance(y_size, float)
+
+    hasher = hashlib.sha1()
+    hasher.update(utf8_bytes(repr((PAGE_CACHE_VERSION, x_size, y_size,
+      font_metrics._family))))
+    for organizer, key, x_origin, y_origin in placements:
+        drawer = organizer._table[key]
+        hasher.update(utf8_bytes(repr((organizer._length, organizer._width,
+          organizer._height, organizer._font_height, organizer._front_rows,
+          key, x_origin, y_origin,
+          drawer._front_lines, drawer._bottom_lines))))
+    return hasher.hexdigest()
 
 class Organizers:
     def __init__(self):
-	""" *Organizers*: Initialize. """
-	self._organizers = []
-
-    def organizer_add(self, organizer):
-	""" *Organizers*: Add *organizer* to *self* """
-	# Check argument types:
-	assert isinstance(organizer, Organizer);
-
-	# Add *origanizer* to *self*:
-	self._organizers.append(organizer)
+        """ *Organizers*: Initialize. """
+        self._organizers = []
+        self._positions = []
+        self._organizer_positions = {}
+        self._registered = 0
+        self._index = {}
+        self._catalog_organizers = []
+        self._factories = []
+        self._keys_index = None
+        self._reported = set()
+
+    def factory_add(self, factory, manifest=None):
+        """ *Organizers*: Register *factory*, a function that returns an
+            *Organizer*, to be called only once one of its keys is drawn.
+            The keys come from *manifest*; without one *factory* is called
+            by the first lookup, and when the manifest is out of date it is
+            called right away.  An invalid organizer raises
+            *ValueError* and is not added. """
+        # Check argument types:
+        assert manifest is None or isinstance(manifest, FactoryManifest)
+
+        # The organizer keeps this place among the others however late it
+        # is built:
+        position = self._registered
+        self._registered += 1
+
+        keys = None
+        if manifest is not None:
+            name = factory.__name__
+            keys = manifest.keys_get(name)
+            if keys is None:
+                with profiler.stage("catalog.build"):
+                    organizer = factory()
+                    organizer_check(organizer)
+                manifest.keys_set(name, list(organizer._keys))
+                self.organizer_add(organizer, position)
+                return
+
+            # Report collisions now rather than whenever both get built:
+            for key in keys:
+                others = self.organizers_find(key)
+                if others:
+                    for other in others:
+                        self.collision_report(key, other._name, name)
+                else:
+                    for other_position, other_factory, other_keys in \
+                      self._factories:
+                        if other_keys and key in other_keys:
+                            self.collision_report(key, other_factory.__name__,
+                              name)
+                            break
+        self._factories.append((position, factory, keys and set(keys)))
+
+    def factories_build(self, keys_match):
+        """ *Organizers*: Build every registered factory whose keys are
+            unknown or whose set of keys passes *keys_match* and return
+            *True* if any were built.  An invalid organizer raises
+            *ValueError* and is not added. """
+        result = False
+        pending = list(self._factories)
+        for position, factory, keys in pending:
+            if keys is None or keys_match(keys):
+                # Even a factory that fails is only ever called once:
+                self._factories.remove((position, factory, keys))
+                with profiler.stage("catalog.build"):
+                    organizer = factory()
+                    organizer_check(organizer)
+                # Collisions of known keys were reported by *factory_add*:
+                self.organizer_add(organizer, position, keys is not None)
+                result = True
+        return result
+
+    def organizer_add(self, organizer, position=None, reported=False):
+        """ *Organizers*: Add *organizer* to *self* at registration
+            *position* (after everything registered so far if *None*) and
+            return *False* if any of its drawer keys are already defined by
+            another organizer.  Such collisions are printed unless they
+            were already *reported*. """
+        # Check argument types:
+        assert isinstance(organizer, Organizer);
+        assert position is None or isinstance(position, int)
+
+        # Add *origanizer* to *self* in registration order, whenever it was
+        # built; catalogs were checked when they were read, but --strict
+        # checks them again in full:
+        if strict:
+            organizer_check(organizer)
+        if position is None:
+            position = self._registered
+            self._registered += 1
+        place = bisect.bisect(self._positions, position)
+        self._positions.insert(place, position)
+        self._organizers.insert(place, organizer)
+        self._organizer_positions[organizer] = position
+        self._keys_index = None
+
+        # Catalog organizers carry their own index, so their keys are
+        # looked up in it rather than in *index*:
+        catalog = isinstance(organizer._table, CatalogTable)
+        index = self._index
+        positions = self._organizer_positions
+        result = True
+        for key in organizer._table:
+            # The organizer that was registered first keeps *key*:
+            others = self.organizers_find(key)
+            if not catalog:
+                other = index.get(key)
+                if other is None or position < positions[other]:
+                    index[key] = organizer
+            if others:
+                result = False
+                if not reported:
+                    for other in others:
+                        if position < positions[other]:
+                            self.collision_report(key, organizer._name,
+                              other._name)
+                        else:
+                            self.collision_report(key, other._name,
+                              organizer._name)
+                continue
+
+            # Also check the organizers that are yet to be built:
+            if not reported:
+                for other_position, factory, keys in self._factories:
+                    if keys and key in keys:
+                        result = False
+                        if other_position < position:
+                            self.collision_report(key, factory.__name__,
+                              organizer._name)
+                        else:
+                            self.collision_report(key, organizer._name,
+                              factory.__name__)
+                        break
+        if catalog:
+            self._catalog_organizers.append(organizer)
+        return result
+
+    def collision_report(self, key, first_name, second_name):
+        """ *Organizers*: Report that drawer *key* of the organizer
+            *second_name* is already defined by the organizer *first_name*,
+            which was registered first. """
+        self._reported.add(key)
+        print("Drawer '{0}' in organizer '{1}' is already defined in "
+          "organizer '{2}'".format(key, second_name, first_name))
+
+    def drawers_lines(self):
+        """ *Organizers*: Build all of the lazy organizers and return a list
+            of (*key*, *front_lines*, *bottom_lines*) for every drawer that
+            *draw* would use, in organizer order. """
+        self.factories_build(lambda keys: True)
+
+        # The organizer that was added first wins, as in *draw*:
+        drawers = []
+        keys = set()
+        for organizer in self._organizers:
+            for key, front_lines, bottom_lines in organizer.drawers_lines():
+                if key not in keys:
+                    keys.add(key)
+                    drawers.append((key, front_lines, bottom_lines))
+        return drawers
+
+    def keys_index(self):
+        """ *Organizers*: Return a sorted list of (*key*, *rank*) for every
+            key of the built in-memory organizers, where *rank* is the
+            (*organizer_position*, *definition_position*) that orders the
+            keys as they appear in the catalogs. """
+        if self._keys_index is None:
+            ranks = {}
+            organizers = self._organizers
+            for position in range(len(organizers)):
+                organizer = organizers[position]
+                if not isinstance(organizer._table, CatalogTable):
+                    keys = organizer._keys
+                    for order in range(len(keys)):
+                        ranks.setdefault(keys[order], (position, order))
+            self._keys_index = sorted(ranks.items())
+        return self._keys_index
+
+    def select(self, selector):
+        """ *Organizers*: Return the keys that *selector* matches in catalog
+            order.  *selector* is either a glob pattern such as "hw10rw*" or
+            an inclusive range such as "hw0fm0..hw0fm5". """
+        # Check argument types:
+        assert isinstance(selector, str)
+
+        # Matching keys all sort at or after *low* and stop being *within*
+        # reach at the first key that sorts after them:
+        if ".." in selector:
+            low, high = selector.split("..", 1)
+            def within(key):
+                return key <= high
+            def match(key):
+                return low <= key <= high
+        else:
+            low = selector
+            for index in range(len(selector)):
+                if selector[index] in "*?[":
+                    low = selector[:index]
+                    break
+            def within(key):
+                return key.startswith(low)
+            def match(key):
+                return fnmatch.fnmatchcase(key, selector)
+
+        # Build the lazy organizers that have any matching keys:
+        def keys_match(keys):
+            for key in keys:
+                if match(key):
+                    return True
+            return False
+        self.factories_build(keys_match)
+
+        # Scan the sorted keys of every organizer from *low* onwards:
+        matches = []
+        keys_index = self.keys_index()
+        for index in range(bisect.bisect_left(keys_index, (low,)),
+          len(keys_index)):
+            key, rank = keys_index[index]
+            if not within(key):
+                break
+            if match(key):
+                matches.append((rank, key))
+        organizers = self._organizers
+        for position in range(len(organizers)):
+            table = organizers[position]._table
+            if isinstance(table, CatalogTable):
+                for key, order in table._index.scan(low, within):
+                    if match(key):
+                        matches.append(((position, order), key))
+
+        # Put the matches in catalog order, dropping keys that an earlier
+        # organizer already matched:
+        matches.sort()
+        keys = []
+        seen = set()
+        for rank, key in matches:
+            if key not in seen:
+                seen.add(key)
+                keys.append(key)
+        return keys
+
+    def organizers_find(self, key):
+        """ *Organizers*: Return the built organizers that define *key*. """
+        organizers = []
+        organizer = self._index.get(key)
+        if organizer is not None:
+            organizers.append(organizer)
+        for catalog_organizer in self._catalog_organizers:
+            if key in catalog_organizer._table:
+                organizers.append(catalog_organizer)
+        return organizers
 
     def draw(self, key):
-	""" *Organziers*: Cause the drawer named *key* to be drawn. """
-	# Check argument types:
-	assert isinstance(key, str)
-
-	# Search through *self* looking for a drawer that matches *key:
-	result = False
-	for organizer in self._organizers:
-	    if organizer.draw(key):
-		result = True
-		break
-	return result
-
-    def done(self):
-	""" *Organizers*: Force all of the drawings to be generated: """
-
-	file_names = []
-	for organizer in self._organizers:
-	    file_names += organizer.done()
-	return file_names
+        """ *Organziers*: Cause the drawer named *key* to be drawn. """
+        # Check argument types:
+        assert isinstance(key, str)
+
+        # Look up the organizers that hold *key*, first building any lazy
+        # ones that hold it, as they may have been registered earlier:
+        self.factories_build(lambda keys: key in keys)
+        organizers = self.organizers_find(key)
+
+        result = False
+        if organizers:
+            # The organizer that was registered first wins:
+            organizers.sort(key=self._organizers.index)
+            if len(organizers) > 1 and key not in self._reported:
+                self._reported.add(key)
+                print("Drawer '{0}' is defined in organizers {1}; using '{2}'".
+                  format(key, ", ".join(["'{0}'".format(organizer._name)
+                  for organizer in organizers]), organizers[0]._name))
+            result = organizers[0].draw(key)
+        return result
+
+    def pending_clear(self):
+        """ *Organizers*: Forget all of the drawers scheduled so far. """
+        for organizer in self._organizers:
+            organizer._pending = []
+
+    def done(self, renderer=None, sheet=None):
+        """ *Organizers*: Force all of the drawings to be generated: """
+        # Check argument types:
+        assert renderer is None or isinstance(renderer, Renderer)
+        assert sheet is None or isinstance(sheet, Sheet)
+
+        # Default to SVG pages converted by *inkscape*:
+        if renderer is None:
+            renderer = SvgRenderer(InkscapeConverter())
+
+        self.pages_draw(renderer, sheet)
+        return renderer.finish()
+
+    def pages_draw(self, renderer, sheet=None):
+        """ *Organizers*: Draw the pending drawers of every organizer as
+            pages of *renderer* laid out on *sheet*. """
+        # Check argument types:
+        assert isinstance(renderer, Renderer)
+        assert sheet is None or isinstance(sheet, Sheet)
+
+        if sheet is not None and sheet._dense:
+            # Pool the pending drawers of every organizer so that they can
+            # share pages:
+            pending = []
+            for organizer in self._organizers:
+                for key in organizer._pending:
+                    pending.append((organizer, key))
+            pages = sheet.pages_layout([(organizer._height + organizer._length,
+              organizer._width) for organizer, key in pending], 0)
+            pages_render(renderer, [[pending[index] + (x_origin, y_origin)
+              for index, x_origin, y_origin in page] for page in pages],
+              sheet)
+        else:
+            for organizer in self._organizers:
+                organizer.pages_draw(renderer, sheet)
+
+def native_str(text):
+    """ Return *text* (either bytes or unicode) as the native *str* type. """
+    if isinstance(text, str):
+        return text
+    if str is bytes:
+        return text.encode("utf-8")
+    return text.decode("utf-8")
+
+def utf8_bytes(text):
+    """ Return *text* as UTF-8 encoded bytes. """
+    if isinstance(text, bytes):
+        return text
+    return text.encode("utf-8")
+
+def catalog_read(file_name):
+    """ Read the drawer catalog in *file_name* and return a (*geometry*,
+        *drawers*) tuple, where *geometry* holds the *Organizer* arguments
+        and *drawers* is a list of (*key*, *front_lines*, *bottom_lines*)
+        tuples in catalog order.
+
+        JSON and TOML catalogs look like:
+
+            {"organizer": {"name": "Electronics", "length": 116.0,
+               "width": 49.0, "height": 12.0, "font_height": 4.0,
+               "front_rows": 2, "labels_per_page": 5},
+             "drawers": [{"key": "cceramic10pf50v",
+               "front": ["10 pF 50V", "Ceramic Capacitor"],
+               "bottom": ["J:15334"]}, ...]}
+
+        CSV catalogs start with an "@organizer" row followed by one
+        "key,front,bottom" row per drawer where lines are separated by '|':
+
+            @organizer,Electronics,116.0,49.0,12.0,4.0,2,5
+            cceramic10pf50v,10 pF 50V|Ceramic Capacitor,J:15334
+    """
+    # Check argument types:
+    assert isinstance(file_name, str)
+
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension == ".csv":
+        if str is bytes:
+            in_file = open(file_name, "rb")
+        else:
+            in_file = open(file_name, newline="")
+        rows = [row for row in csv.reader(in_file) if row]
+        in_file.close()
+        if not rows or rows[0][0] != "@organizer" or len(rows[0]) != 8:
+            raise ValueError("{0}: first row must be '@organizer,name,"
+              "length,width,height,font_height,front_rows,labels_per_page'".
+              format(file_name))
+        values = rows[0][1:]
+        geometry = {"name": values[0], "length": values[1],
+          "width": values[2], "height": values[3],
+          "font_height": values[4], "front_rows": values[5],
+          "labels_per_page": values[6]}
+        entries = []
+        for row in rows[1:]:
+            row = row + ["", ""]
+            entries.append({"key": row[0],
+              "front": [line for line in row[1].split("|") if line],
+              "bottom": [line for line in row[2].split("|") if line]})
+    elif extension in (".json", ".toml"):
+        in_file = open(file_name, "rb")
+        text = in_file.read().decode("utf-8")
+        in_file.close()
+        if extension == ".json":
+            document = json.loads(text)
+        elif tomllib is None:
+            raise ValueError("{0}: reading TOML catalogs needs the 'tomllib' "
+              "or 'toml' module".format(file_name))
+        else:
+            document = tomllib.loads(text)
+        geometry = document.get("organizer", {})
+        entries = document.get("drawers", [])
+    else:
+        raise ValueError("{0}: catalogs must be .csv, .json or .toml files".
+          format(file_name))
+
+    # Normalize the geometry:
+    try:
+        geometry = {"name": native_str(geometry["name"]),
+          "length": float(geometry["length"]),
+          "width": float(geometry["width"]),
+          "height": float(geometry["height"]),
+          "font_height": float(geometry["font_height"]),
+          "front_rows": int(geometry["front_rows"]),
+          "labels_per_page": int(geometry["labels_per_page"])}
+    except (KeyError, ValueError, TypeError) as error:
+        raise ValueError("{0}: bad organizer geometry ({1})".format(
+          file_name, error))
+
+    # Normalize the drawers, keeping the first of any duplicated keys:
+    drawers = []
+    keys = set()
+    for number in range(len(entries)):
+        entry = entries[number]
+        try:
+            key = native_str(entry["key"])
+            front_lines = entry.get("front", [])
+            bottom_lines = entry.get("bottom", [])
+            if not isinstance(front_lines, list) or \
+              not isinstance(bottom_lines, list):
+                raise TypeError
+            front_lines = [native_str(line) for line in front_lines]
+            bottom_lines = [native_str(line) for line in bottom_lines]
+        except KeyError:
+            raise ValueError("{0}: drawer number {1} has no key".format(
+              file_name, number + 1))
+        except (TypeError, AttributeError):
+            raise ValueError("{0}: drawer number {1} must have a string key "
+              "and lists of strings for its front and bottom lines".format(
+              file_name, number + 1))
+        if key in keys:
+            print("{0}: drawer '{1}' is defined more than once".format(
+              file_name, key))
+            continue
+        keys.add(key)
+        drawers.append((key, front_lines, bottom_lines))
+
+    # Check everything once here so that drawing need not:
+    problems = catalog_validate(file_name, geometry, drawers)
+    if problems:
+        raise ValueError("\n".join(problems))
+    for overflow in catalog_overflows(file_name, Organizer(**geometry),
+      drawers):
+        print(overflow)
+    return geometry, drawers
+
+def catalog_validate(source, geometry, drawers):
+    """ Check the organizer *geometry* and *drawers* (in the form returned
+        by *catalog_read*) that came from *source* and return a list of
+        problems (empty if all is well). """
+    # Check argument types:
+    assert isinstance(source, str)
+    assert isinstance(geometry, dict)
+    assert isinstance(drawers, list)
+
+    # Check the organizer geometry:
+    problems = []
+    if not isinstance(geometry["name"], str) or not geometry["name"]:
+        problems.append("{0}: organizer name must be a non-empty string".
+          format(source))
+    for field in ("length", "width", "height", "font_height"):
+        value = geometry[field]
+        if not isinstance(value, float) or not value > 0.0:
+            problems.append("{0}: organizer {1} must be a positive number "
+              "of millimeters, not {2!r}".format(source, field, value))
+    for field in ("front_rows", "labels_per_page"):
+        value = geometry[field]
+        if not isinstance(value, int) or value < 1:
+            problems.append("{0}: organizer {1} must be a positive integer, "
+              "not {2!r}".format(source, field, value))
+    if problems:
+        return problems
+    front_rows = geometry["front_rows"]
+    if front_rows * geometry["font_height"] > geometry["height"]:
+        problems.append("{0}: {1} front rows of {2}mm text do not fit on a "
+          "{3}mm high drawer front".format(source, front_rows,
+          geometry["font_height"], geometry["height"]))
+
+    # Check each drawer:
+    for key, front_lines, bottom_lines in drawers:
+        if not isinstance(key, str) or not key or len(key.split()) != 1:
+            problems.append("{0}: drawer key {1!r} must be a non-empty "
+              "string without spaces".format(source, key))
+            continue
+        for lines in (front_lines, bottom_lines):
+            if not isinstance(lines, list) or \
+              [line for line in lines if not isinstance(line, str)]:
+                problems.append("{0}: drawer '{1}' lines must be a list of "
+                  "strings, not {2!r}".format(source, key, lines))
+                continue
+            # PDF labels are WinAnsi encoded, so check that now rather than
+            # failing halfway through drawing:
+            for line in lines:
+                try:
+                    winansi_str(line)
+                except UnicodeError:
+                    problems.append("{0}: drawer '{1}' line {2!r} has "
+                      "characters that labels cannot show".format(source,
+                      key, line))
+        if isinstance(front_lines, list) and len(front_lines) > front_rows:
+            problems.append("{0}: drawer '{1}' has {2} front lines but only "
+              "{3} fit".format(source, key, len(front_lines), front_rows))
+    return problems
+
+def catalog_overflows(source, organizer, drawers):
+    """ Return a list of warnings about the lines of *drawers* (in the form
+        returned by *catalog_read*) from *source* that do not fit on the
+        labels of *organizer* even when shrunk. """
+    # Check argument types:
+    assert isinstance(source, str)
+    assert isinstance(organizer, Organizer)
+    assert isinstance(drawers, list)
+
+    warnings = []
+    for key, front_lines, bottom_lines in drawers:
+        for overflow in organizer.lines_fit(front_lines, bottom_lines)[2]:
+            warnings.append("{0}: drawer '{1}' line '{2}' does not fit on "
+              "its {3}mm wide label".format(source, key, overflow,
+              organizer._width))
+    return warnings
+
+def organizer_check(organizer):
+    """ Raise *ValueError* listing the problems with *organizer*, if any, as
+        *catalog_read* does for catalogs, and otherwise print any of its
+        lines that do not fit. """
+    problems = organizer.validate()
+    if problems:
+        raise ValueError("\n".join(problems))
+    for warning in catalog_overflows("Organizer '{0}'".format(
+      organizer._name), organizer, organizer.drawers_lines()):
+        print(warning)
+
+class CatalogIndex:
+    # The index file starts with a header and the organizer name, followed
+    # by one fixed size directory entry per drawer sorted by key, followed
+    # by the keys and encoded drawer records that the entries point at:
+    MAGIC = b"DLCI"
+    VERSION = 2
+    HEADER = struct.Struct("<4sHHdQddddHHI")
+    ENTRY = struct.Struct("<IHIII")
+    LINES = struct.Struct("<HH")
+    LINE = struct.Struct("<H")
+
+    def __init__(self, file_name):
+        """ *CatalogIndex*: Open the compiled index for the catalog
+            *file_name*, (re)building it first if the catalog changed. """
+        # Check argument types:
+        assert isinstance(file_name, str)
+
+        # Load up *self*:
+        self._file_name = file_name
+        self._index_file_name = file_name + ".index"
+        self._mmap = None
+        if not self.open():
+            CatalogIndex.compile(file_name, self._index_file_name)
+            if not self.open():
+                raise ValueError("{0}: could not build catalog index".format(
+                  file_name))
+
+    def open(self):
+        """ *CatalogIndex*: Map the index file and return *True* if it is
+            up to date with respect to its catalog. """
+        try:
+            status = os.stat(self._file_name)
+            index_file = open(self._index_file_name, "rb")
+        except (IOError, OSError):
+            return False
+        try:
+            data = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            index_file.close()
+            return False
+        index_file.close()
+
+        header_size = CatalogIndex.HEADER.size
+        if len(data) < header_size:
+            data.close()
+            return False
+        (magic, version, name_length, source_mtime, source_size,
+          length, width, height, font_height, front_rows, labels_per_page,
+          count) = CatalogIndex.HEADER.unpack_from(data, 0)
+        if magic != CatalogIndex.MAGIC or version != CatalogIndex.VERSION or \
+          source_mtime != status.st_mtime or source_size != status.st_size:
+            data.close()
+            return False
+
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = data
+        self._count = count
+        self._entries_offset = header_size + name_length
+        self._geometry = {
+          "name": native_str(data[header_size:header_size + name_length]),
+          "length": length, "width": width, "height": height,
+          "font_height": font_height, "front_rows": front_rows,
+          "labels_per_page": labels_per_page}
+        return True
+
+    @staticmethod
+    def compile(file_name, index_file_name):
+        """ *CatalogIndex*: Compile the catalog *file_name* into the index
+            file *index_file_name*. """
+        # Check argument types:
+        assert isinstance(file_name, str)
+        assert isinstance(index_file_name, str)
+
+        status = os.stat(file_name)
+        geometry, drawers = catalog_read(file_name)
+
+        # Encode the keys and records back to back:
+        blobs = []
+        entries = []
+        name = utf8_bytes(geometry["name"])
+        offset = (CatalogIndex.HEADER.size + len(name) +
+          CatalogIndex.ENTRY.size * len(drawers))
+        for order in range(len(drawers)):
+            key, front_lines, bottom_lines = drawers[order]
+            key = utf8_bytes(key)
+            record = [CatalogIndex.LINES.pack(len(front_lines),
+              len(bottom_lines))]
+            for line in front_lines + bottom_lines:
+                line = utf8_bytes(line)
+                record.append(CatalogIndex.LINE.pack(len(line)))
+                record.append(line)
+            record = b"".join(record)
+            entries.append((key, offset, len(key), offset + len(key),
+              len(record), order))
+            blobs.append(key)
+            blobs.append(record)
+            offset += len(key) + len(record)
+        entries.sort()
+
+        # Write out the header, name, sorted entries and blobs:
+        parts = [CatalogIndex.HEADER.pack(CatalogIndex.MAGIC,
+          CatalogIndex.VERSION, len(name), status.st_mtime, status.st_size,
+          geometry["length"], geometry["width"], geometry["height"],
+          geometry["font_height"], geometry["front_rows"],
+          geometry["labels_per_page"], len(drawers)), name]
+        for entry in entries:
+            parts.append(CatalogIndex.ENTRY.pack(*entry[1:]))
+        parts.extend(blobs)
+        file_replace(index_file_name, b"".join(parts))
+
+    def entry(self, index):
+        """ *CatalogIndex*: Return the (*key*, *record_offset*,
+            *record_length*, *order*) for the *index*'th key in key order. """
+        key_offset, key_length, record_offset, record_length, order = \
+          CatalogIndex.ENTRY.unpack_from(self._mmap,
+          self._entries_offset + index * CatalogIndex.ENTRY.size)
+        return (self._mmap[key_offset:key_offset + key_length],
+          record_offset, record_length, order)
+
+    def find(self, key):
+        """ *CatalogIndex*: Return the directory index of *key* or -1. """
+        # Check argument types:
+        assert isinstance(key, str)
+
+        key = utf8_bytes(key)
+        low = self.lower_bound(key)
+        if low < self._count and self.entry(low)[0] == key:
+            return low
+        return -1
+
+    def lower_bound(self, key):
+        """ *CatalogIndex*: Return the directory index of the first key that
+            is not less than the UTF-8 encoded *key*. """
+        # Binary search the sorted directory:
+        low = 0
+        high = self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self.entry(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def scan(self, key, within):
+        """ *CatalogIndex*: Return a list of (*key*, *order*) for the keys in
+            key order, starting at the first key not less than *key* and
+            stopping at the first one that *within* rejects. """
+        # Check argument types:
+        assert isinstance(key, str)
+
+        keys = []
+        for index in range(self.lower_bound(utf8_bytes(key)), self._count):
+            entry = self.entry(index)
+            entry_key = native_str(entry[0])
+            if not within(entry_key):
+                break
+            keys.append((entry_key, entry[3]))
+        return keys
+
+    def lines(self, index):
+        """ *CatalogIndex*: Decode and return the (*front_lines*,
+            *bottom_lines*) of the *index*'th key. """
+        data = self._mmap
+        key, offset, length, order = self.entry(index)
+        front_count, bottom_count = CatalogIndex.LINES.unpack_from(data, offset)
+        offset += CatalogIndex.LINES.size
+        lines = []
+        for line_index in range(front_count + bottom_count):
+            line_length = CatalogIndex.LINE.unpack_from(data, offset)[0]
+            offset += CatalogIndex.LINE.size
+            lines.append(native_str(data[offset:offset + line_length]))
+            offset += line_length
+        return lines[:front_count], lines[front_count:]
+
+    def items(self):
+        """ *CatalogIndex*: Return a list of (*key*, *front_lines*,
+            *bottom_lines*) for every drawer in catalog order. """
+        orders = [(self.entry(index)[3], index) for index in range(self._count)]
+        orders.sort()
+        items = []
+        for order, index in orders:
+            front_lines, bottom_lines = self.lines(index)
+            items.append((native_str(self.entry(index)[0]), front_lines,
+              bottom_lines))
+        return items
+
+    def keys(self):
+        """ *CatalogIndex*: Return all of the keys in catalog order. """
+        entries = [self.entry(index) for index in range(self._count)]
+        entries.sort(key=lambda entry: entry[3])
+        return [native_str(entry[0]) for entry in entries]
+
+class CatalogTable:
+    def __init__(self, organizer, index):
+        """ *CatalogTable*: Initialize a read-only drawer table for
+            *organizer* that decodes drawers from *index* on demand. """
+        # Check argument types:
+        assert isinstance(organizer, Organizer)
+        assert isinstance(index, CatalogIndex)
+
+        # Load up *self*:
+        self._organizer = organizer
+        self._index = index
+        self._drawers = {}
+
+    def __contains__(self, key):
+        """ *CatalogTable*: Return *True* if *key* is in the catalog. """
+        return key in self._drawers or self._index.find(key) >= 0
+
+    def __getitem__(self, key):
+        """ *CatalogTable*: Return the *Drawer* for *key*. """
+        drawers = self._drawers
+        drawer = drawers.get(key)
+        if drawer is None:
+            index = self._index.find(key)
+            if index < 0:
+                raise KeyError(key)
+            front_lines, bottom_lines = self._index.lines(index)
+            drawer = Drawer(self._organizer, key, front_lines, bottom_lines)
+            drawers[key] = drawer
+        return drawer
+
+    def __iter__(self):
+        """ *CatalogTable*: Iterate over all of the keys (decodes them all).
+        """
+        return iter(self._index.keys())
+
+    def __len__(self):
+        """ *CatalogTable*: Return the number of drawers. """
+        return self._index._count
+
+def catalog_organizer(file_name):
+    """ Return an *Organizer* whose drawers are read on demand from the
+        compiled index of the catalog *file_name*. """
+    # Check argument types:
+    assert isinstance(file_name, str)
+
+    index = CatalogIndex(file_name)
+    geometry = index._geometry
+    organizer = Organizer(geometry["name"], geometry["length"],
+      geometry["width"], geometry["height"], geometry["font_height"],
+      geometry["front_rows"], geometry["labels_per_page"])
+    organizer._table = CatalogTable(organizer, index)
+    return organizer
+
+class FactoryManifest:
+    def __init__(self, file_name, stamp):
+        """ *FactoryManifest*: Initialize a record, stored in *file_name*, of
+            the drawer keys that each organizer factory defines.  The record
+            is only trusted while the source *stamp* is unchanged. """
+        # Check argument types:
+        assert isinstance(file_name, str)
+        assert isinstance(stamp, list)
+
+        # Load up *self*:
+        self._file_name = file_name
+        self._stamp = stamp
+        self._keys = {}
+        self._changed = False
+        try:
+            in_file = open(file_name, "rb")
+            manifest = json.loads(in_file.read().decode("utf-8"))
+            in_file.close()
+        except (IOError, OSError, ValueError):
+            manifest = {}
+        if manifest.get("stamp") == stamp:
+            for name, keys in manifest.get("keys", {}).items():
+                self._keys[native_str(name)] = \
+                  [native_str(key) for key in keys]
+
+    def keys_get(self, name):
+        """ *FactoryManifest*: Return the keys of factory *name* or *None*.
+        """
+        return self._keys.get(name)
+
+    def keys_set(self, name, keys):
+        """ *FactoryManifest*: Record that factory *name* defines *keys*. """
+        # Check argument types:
+        assert isinstance(name, str)
+        assert isinstance(keys, list)
+
+        self._keys[name] = keys
+        self._changed = True
+
+    def save(self):
+        """ *FactoryManifest*: Write *self* out if anything changed. """
+        if self._changed:
+            try:
+                directory = os.path.dirname(self._file_name)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                file_replace(self._file_name, json.dumps({"stamp": self._stamp,
+                  "keys": self._keys}).encode("utf-8"))
+                self._changed = False
+            except (IOError, OSError):
+                pass
+
+class CatalogSnapshot:
+    def __init__(self, file_name):
+        """ *CatalogSnapshot*: Initialize a record, stored in *file_name*, of
+            what each drawer label said when the labels were last printed.
+        """
+        # Check argument types:
+        assert isinstance(file_name, str)
+
+        # Load up *self*:
+        self._file_name = file_name
+        self._digests = {}
+        self._new_digests = None
+        self._found = False
+        try:
+            in_file = open(file_name, "rb")
+            snapshot = json.loads(in_file.read().decode("utf-8"))
+            in_file.close()
+        except (IOError, OSError, ValueError):
+            snapshot = {}
+        if snapshot.get("version") == 1:
+            self._found = True
+            for key, digest in snapshot.get("digests", {}).items():
+                self._digests[native_str(key)] = native_str(digest)
+
+    @staticmethod
+    def digest(front_lines, bottom_lines):
+        """ *CatalogSnapshot*: Return a short digest of a drawer's lines. """
+        return hashlib.sha1(utf8_bytes(json.dumps([front_lines,
+          bottom_lines]))).hexdigest()[:16]
+
+    def changed(self, organizers):
+        """ *CatalogSnapshot*: Return the keys, in catalog order, of the
+            drawers in *organizers* that are new or whose lines differ from
+            *self*.  The current state is remembered for *save*.  With no
+            stored snapshot there is nothing to compare against, so no keys
+            are returned and *save* just records the current state. """
+        # Check argument types:
+        assert isinstance(organizers, Organizers)
+
+        digests = self._digests
+        new_digests = {}
+        keys = []
+        for key, front_lines, bottom_lines in organizers.drawers_lines():
+            digest = CatalogSnapshot.digest(front_lines, bottom_lines)
+            new_digests[key] = digest
+            if self._found and digests.get(key) != digest:
+                keys.append(key)
+        self._new_digests = new_digests
+        return keys
+
+    def save(self):
+        """ *CatalogSnapshot*: Replace the stored snapshot with the state
+            seen by the last call to *changed*. """
+        if self._new_digests is None:
+            return
+        directory = os.path.dirname(self._file_name)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        file_replace(self._file_name, json.dumps({"version": 1,
+          "digests": self._new_digests}, sort_keys=True).encode("utf-8"))
+        self._digests = self._new_digests
+        self._new_digests = None
+        self._found = True
+
+def source_stamp():
+    """ Return a [*mtime*, *size*] stamp of this source file. """
+    file_name = os.path.abspath(__file__)
+    if file_name.endswith((".pyc", ".pyo")):
+        file_name = file_name[:-1]
+    status = os.stat(file_name)
+    return [status.st_mtime, status.st_size]
+
+def labels_generate(organizers, drawer_names, renderer_create,
+  output_file_name, sheet=None):
+    """ Generate the labels for *drawer_names* from *organizers* laid out on
+        *sheet* and leave them in the single PDF *output_file_name*.  All
+        intermediate files go into a private scratch directory that is
+        passed to *renderer_create* to get the renderer, so any number of
+        jobs can run at the same time.  Return a list of error messages,
+        which is empty on success. """
+    # Check argument types:
+    assert isinstance(organizers, Organizers)
+    assert isinstance(drawer_names, list)
+    assert isinstance(output_file_name, str)
+
+    errors = []
+    with profiler.stage("schedule"):
+        for drawer_name in drawer_names:
+            if organizers.draw(drawer_name):
+                continue
+            if ".." not in drawer_name and \
+              not [character for character in "*?[" if character in
+              drawer_name]:
+                errors.append("No drawer named '{0}'".format(drawer_name))
+                continue
+            keys = organizers.select(drawer_name)
+            if not keys:
+                errors.append("No drawers match '{0}'".format(drawer_name))
+            for key in keys:
+                organizers.draw(key)
+    if errors:
+        organizers.pending_clear()
+        return errors
+
+    directory = tempfile.mkdtemp(prefix="drawer_labeler-")
+    try:
+        renderer = renderer_create(directory)
+        assert isinstance(renderer, Renderer)
+        with profiler.stage("render"):
+            file_names = organizers.done(renderer, sheet)
+        labels_file_name = os.path.join(directory, "labels.pdf")
+        if len(file_names) > 1:
+            command = ["pdfunite"]
+            for file_name in file_names:
+                print("Generated file: '{0}'".format(file_name))
+                command.append(file_name)
+            command.append(labels_file_name)
+            try:
+                with profiler.stage("pdfunite"):
+                    subprocess.check_call(command)
+            except (OSError, subprocess.CalledProcessError):
+                errors.append("Command '{0}' failed".format(
+                  " ".join(command)))
+        elif len(file_names) == 1:
+            labels_file_name = file_names[0]
+
+        # Only a complete result ever replaces *output_file_name*:
+        if not errors and file_names:
+            try:
+                shutil.move(labels_file_name, output_file_name)
+            except (IOError, OSError) as error:
+                errors.append("Could not write '{0}': {1}".format(
+                  output_file_name, error.strerror))
+    finally:
+        organizers.pending_clear()
+        shutil.rmtree(directory, ignore_errors=True)
+    return errors
+
+class LabelJob:
+    def __init__(self, request):
+        """ *LabelJob*: Initialize a job for the decoded JSON *request*. """
+        # Check argument types:
+        assert isinstance(request, dict)
+
+        # Load up *self*:
+        self._request = request
+        self._response = None
+        self._done = threading.Event()
+
+class LabelServer:
+    def __init__(self, organizers, renderer_create, sheet=None,
+      extension="pdf"):
+        """ *LabelServer*: Initialize a server that keeps *organizers* warm
+            and renders each job onto *sheet* with a fresh renderer obtained
+            by calling *renderer_create* with the job's scratch directory.
+            The renderer writes files ending in *extension*. """
+        # Check argument types:
+        assert isinstance(organizers, Organizers)
+        assert sheet is None or isinstance(sheet, Sheet)
+        assert isinstance(extension, str)
+
+        # Load up *self*:
+        self._organizers = organizers
+        self._sheet = sheet
+        self._extension = extension
+        self._renderer_create = renderer_create
+        self._jobs = queue.Queue()
+        self._job_count = 0
+
+        # A single worker owns *organizers*, so jobs never see each other's
+        # pending drawers:
+        worker = threading.Thread(target=self.jobs_run)
+        worker.daemon = True
+        worker.start()
+
+    def submit(self, request):
+        """ *LabelServer*: Queue the JSON *request*, wait for it to be
+            rendered and return the JSON response. A request looks like
+            {"id": ..., "keys": [...], "output": "file.pdf"}, where "id"
+            and "output" are optional (but "output" must end in the
+            renderer's extension), and the response looks like
+            {"id": ..., "ok": true, "files": [...], "errors": [...]}. """
+        job = LabelJob(request)
+        self._jobs.put(job)
+        job._done.wait()
+        return job._response
+
+    def jobs_run(self):
+        """ *LabelServer*: Render queued jobs one at a time, forever. """
+        while True:
+            job = self._jobs.get()
+            try:
+                job._response = self.job_run(job._request)
+            except Exception as error:
+                self._organizers.pending_clear()
+                job._response = {"id": job._request.get("id"), "ok": False,
+                  "files": [], "errors": [str(error)]}
+            job._done.set()
+
+    def job_run(self, request):
+        """ *LabelServer*: Render the JSON *request* and return the JSON
+            response. """
+        self._job_count += 1
+        keys = request.get("keys")
+        if not isinstance(keys, list) or not keys:
+            return {"id": request.get("id"), "ok": False, "files": [],
+              "errors": ["Request needs a non-empty 'keys' list"]}
+        keys = [native_str(key) for key in keys]
+        output_file_name = native_str(request.get("output") or
+          "labels{0}.{1}".format(self._job_count, self._extension))
+        if os.path.splitext(output_file_name)[1].lower() != \
+          "." + self._extension:
+            return {"id": request.get("id"), "ok": False, "files": [],
+              "errors": ["Output '{0}' must end in .{1}".format(
+              output_file_name, self._extension)]}
+
+        errors = labels_generate(self._organizers, keys,
+          self._renderer_create, output_file_name, self._sheet)
+        files = []
+        if not errors:
+            files.append(os.path.abspath(output_file_name))
+        return {"id": request.get("id"), "ok": not errors, "files": files,
+          "errors": errors}
+
+    def stream_serve(self, in_file, out_file):
+        """ *LabelServer*: Answer JSON line requests from *in_file* with JSON
+            line responses to *out_file* until *in_file* ends. """
+        while True:
+            line = in_file.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("request must be a JSON object")
+            except ValueError as error:
+                response = {"id": None, "ok": False, "files": [],
+                  "errors": ["Bad request: {0}".format(error)]}
+            else:
+                response = self.submit(request)
+            out_file.write(json.dumps(response) + "\n")
+            out_file.flush()
+
+    def socket_serve(self, socket_file_name):
+        """ *LabelServer*: Accept connections on the Unix socket
+            *socket_file_name* and serve JSON line requests on each one. """
+        # Check argument types:
+        assert isinstance(socket_file_name, str)
+
+        if os.path.exists(socket_file_name):
+            os.remove(socket_file_name)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(socket_file_name)
+        listener.listen(16)
+        try:
+            while True:
+                connection = listener.accept()[0]
+                client = threading.Thread(target=self.connection_serve,
+                  args=(connection,))
+                client.daemon = True
+                client.start()
+        finally:
+            listener.close()
+            os.remove(socket_file_name)
+
+    def connection_serve(self, connection):
+        """ *LabelServer*: Serve JSON line requests on *connection*. """
+        in_file = connection.makefile("r")
+        out_file = connection.makefile("w")
+        try:
+            self.stream_serve(in_file, out_file)
+        except (IOError, OSError, socket.error):
+            pass
+        finally:
+            in_file.close()
+            out_file.close()
+            connection.close()
 
 def main():
+    global font_metrics
+    global strict
+
+    # Parse the command line:
+    parser = argparse.ArgumentParser(description="Generate drawer labels.")
+    parser.add_argument("drawer_names", nargs="*", metavar="DRAWER",
+      help="name of a drawer to generate a label for, a glob pattern such "
+      "as 'hw10rw*' or an inclusive range such as 'hw0fm0..hw0fm5'")
+    parser.add_argument("--output", default="labels.pdf", metavar="FILE",
+      help="where to put the generated labels (default: labels.pdf)")
+    parser.add_argument("--sheet", default="8x10", metavar="WxH",
+      help="size of the label stock in inches (default: 8x10)")
+    parser.add_argument("--layout", choices=["dense", "column"],
+      default="dense",
+      help="pack drawer outlines into as few pages as possible (the "
+      "default) or print one column of each organizer's labels_per_page")
+    parser.add_argument("--changed", action="store_true",
+      help="also print every drawer whose lines changed since the last "
+      "--changed run (the first run only records what the labels say)")
+    parser.add_argument("--snapshot", metavar="FILE",
+      help="where --changed keeps what was last printed (default: "
+      "snapshot.json in the cache directory)")
+    parser.add_argument("--catalog", action="append", default=[],
+      metavar="FILE",
+      help="also load drawers from a .csv, .json or .toml catalog file")
+    parser.add_argument("--renderer", choices=["pdf", "svg", "raster"],
+      default="pdf",
+      help="write the PDF directly (the default), draw SVG pages and "
+      "convert them with inkscape, or draw 1-bit bitmaps for a thermal "
+      "printer (needs NumPy and an --output ending in .pbm, .png or .raw)")
+    parser.add_argument("--dpi", type=float, default=203.0,
+      help="with --renderer raster, the printer resolution (default: 203)")
+    parser.add_argument("--font", metavar="FILE",
+      help="measure and draw the labels in this TrueType font; the PDF "
+      "renderer embeds just the characters used when fontTools is "
+      "available (which is also needed to first read the font)")
+    parser.add_argument("--validate-svg", action="store_true",
+      help="with --renderer svg, check every SVG element with svgwrite "
+      "(slow; for testing)")
+    parser.add_argument("--cache-directory", metavar="DIRECTORY",
+      default=os.path.join(os.path.expanduser("~"), ".cache",
+      "drawer_labeler"),
+      help="directory of previously generated pages to reuse")
+    parser.add_argument("--cache-size", type=int, default=64, metavar="MB",
+      help="maximum size of the page cache in megabytes")
+    parser.add_argument("--no-cache", action="store_true",
+      help="always draw every page from scratch")
+    parser.add_argument("--cache-stats", action="store_true",
+      help="print page cache statistics when done")
+    parser.add_argument("--workers", type=int,
+      default=multiprocessing.cpu_count(),
+      help="number of pages to convert to PDF at the same time")
+    parser.add_argument("--converter", choices=["shell", "oneshot"],
+      default="shell",
+      help="keep `inkscape --shell` sessions open (the default) or start "
+      "a fresh inkscape for every page")
+    parser.add_argument("--serve", action="store_true",
+      help="keep running and answer JSON line requests such as "
+      "'{\"keys\": [\"hw0fm0\"]}' on standard input")
+    parser.add_argument("--socket", metavar="PATH",
+      help="with --serve, answer requests on this Unix socket instead")
+    parser.add_argument("--profile", action="store_true",
+      help="print how long each stage of the run took")
+    parser.add_argument("--trace", metavar="FILE",
+      help="write the stage timings to FILE as JSON")
+    parser.add_argument("--strict", action="store_true",
+      help="check every drawer and drawing call as it happens (slow; for "
+      "debugging)")
+    arguments = parser.parse_args()
+    if arguments.strict:
+        strict = True
+    if arguments.profile or arguments.trace:
+        profiler.enable()
+    try:
+        x_size, y_size = [float(size) * 25.4
+          for size in arguments.sheet.lower().split("x")]
+    except ValueError:
+        parser.error("--sheet must look like 8x10 (inches)")
+    sheet = Sheet(x_size, y_size, dense=arguments.layout == "dense")
+    if arguments.workers < 1:
+        parser.error("--workers must be at least 1")
+    raster_format = os.path.splitext(arguments.output)[1].lower()[1:]
+    if arguments.renderer == "raster":
+        if raster_format not in ("pbm", "png", "raw"):
+            parser.error("--renderer raster needs an --output file ending "
+              "in .pbm, .png or .raw")
+        if arguments.dpi <= 0.0:
+            parser.error("--dpi must be positive")
+        try:
+            import numpy
+        except ImportError:
+            parser.error("--renderer raster needs the 'numpy' module")
+    if arguments.font:
+        try:
+            font_metrics = FontMetrics.load(arguments.font,
+              arguments.cache_directory)
+            if arguments.renderer == "pdf":
+                PdfFont(arguments.font)
+        except (IOError, OSError, ValueError) as error:
+            parser.error(str(error))
+
     # Create all the drawer labels:
     organizers = Organizers()
-    organizers.organizer_add(electronics_organizer())
-    organizers.organizer_add(hardware_organizer())
-
-    arguments = sys.argv[1:]
-    ok = True
-    for drawer_name in arguments:
-	if not organizers.draw(drawer_name):
-	    print("No drawer named '{0}'".format(drawer_name))
-	    ok = False
-
-    if ok:
-	file_names = organizers.done()
-	if len(file_names) > 1:
-	    command = "pdfunite"
-	    for file_name in file_names:
-		print("Generated file: '{0}'".format(file_name))
-		command += " {0}".format(file_name)
-	    command += " labels.pdf"
-	    #print("command={0}".format(command))
-	    try:
-		subprocess.check_call(command, shell=True)
-	    except subprocess.CalledProcessError as cpe:
-		print("Command '{0}' failed".format(command))
-
-	    for file_name in file_names:
-		os.remove(file_name)
-	else:
-	    os.rename(file_names[0], "labels.pdf")
+    for catalog_file_name in arguments.catalog:
+        try:
+            with profiler.stage("catalog.load"):
+                organizer = catalog_organizer(catalog_file_name)
+            organizers.organizer_add(organizer)
+        except (IOError, OSError, ValueError) as error:
+            parser.error(str(error))
+    manifest = FactoryManifest(os.path.join(arguments.cache_directory,
+      "factories.json"), source_stamp())
+    try:
+        organizers.factory_add(electronics_organizer, manifest)
+        organizers.factory_add(hardware_organizer, manifest)
+    except ValueError as error:
+        parser.error(str(error))
+    manifest.save()
+    cache = None
+    if not arguments.no_cache:
+        cache = PageCache(arguments.cache_directory,
+          arguments.cache_size * 1024 * 1024)
+    converter = None
+    if arguments.renderer == "svg":
+        if arguments.converter == "shell":
+            converter = InkscapeShellConverter(workers=arguments.workers)
+        else:
+            converter = InkscapeConverter(workers=arguments.workers)
+
+    def renderer_create(directory):
+        """ Return a new renderer that works in *directory*. """
+        if arguments.renderer == "raster":
+            return RasterRenderer(os.path.join(directory,
+              "labels." + raster_format), raster_format, arguments.dpi)
+        if converter is None:
+            return PdfRenderer(os.path.join(directory, "labels.pdf"), cache,
+              arguments.font)
+        return SvgRenderer(converter, cache, directory,
+          arguments.validate_svg)
+
+    if arguments.serve:
+        extension = "pdf"
+        if arguments.renderer == "raster":
+            extension = raster_format
+        server = LabelServer(organizers, renderer_create, sheet, extension)
+        try:
+            if arguments.socket:
+                server.socket_serve(arguments.socket)
+            else:
+                # Keep stray messages out of the response stream:
+                out_file = sys.stdout
+                sys.stdout = sys.stderr
+                server.stream_serve(sys.stdin, out_file)
+        except KeyboardInterrupt:
+            pass
+    else:
+        # Add in the drawers that changed since the last snapshot:
+        drawer_names = arguments.drawer_names
+        snapshot = None
+        if arguments.changed:
+            snapshot = CatalogSnapshot(arguments.snapshot or
+              os.path.join(arguments.cache_directory, "snapshot.json"))
+            with profiler.stage("snapshot.diff"):
+                changed_names = snapshot.changed(organizers)
+            if snapshot._found:
+                print("{0} drawers changed since the last snapshot".format(
+                  len(changed_names)))
+            else:
+                print("No snapshot yet; recording the current labels as "
+                  "printed")
+            drawer_names = drawer_names + [drawer_name
+              for drawer_name in changed_names
+              if drawer_name not in drawer_names]
+
+        errors = labels_generate(organizers, drawer_names,
+          renderer_create, arguments.output, sheet)
+        for error in errors:
+            print(error)
+
+        # Only a successful print moves the snapshot forward:
+        if snapshot is not None and not errors:
+            try:
+                snapshot.save()
+            except (IOError, OSError) as error:
+                print("Could not save snapshot '{0}': {1}".format(
+                  snapshot._file_name, error.strerror))
+        if cache is not None and arguments.cache_stats:
+            print(cache.report())
+    if converter is not None:
+        converter.close()
+
+    if arguments.profile:
+        print(profiler.report())
+    if arguments.trace:
+        profiler.trace_write(arguments.trace)
 
 def electronics_organizer():
     o = Organizer(name="Electronics",
@@ -710,7 +3712,7 @@ def electronics_organizer():
 
 def hardware_organizer():
     # FIXME: The orgainzer values are wrong:
-    o = Organizer(name="Electronics",
+    o = Organizer(name="Hardware",
       length=116.0, width=49.0, height=12.0,
       font_height=4.0, front_rows=2, labels_per_page=5)
 
@@ -987,5 +3989,6 @@ def hardware_organizer():
 
     return o
 
-main()
+if __name__ == "__main__":
+    main()
 
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+# An asyncio front end to drawer_labeler for services that run an event loop.
+# The pages are still laid out and drawn by drawer_labeler (in a worker thread,
+# as drawing is all computation), but the `inkscape` conversions are asyncio
+# subprocesses, at most *limit* of them at a time, and each finished page is
+# handed back as soon as it is converted:
+#
+#     async with aclosing(pages_finished(organizers, renderer)) as pages:
+#         async for index, pdf_file_name in pages:
+#             ...
+#
+# Cancelling the task, or leaving the `async for` early inside `aclosing`,
+# stops the drawing, kills the running conversions and removes the files of
+# every page that was not handed back.  Leaving the `async for` without
+# `aclosing` leaves all of that until the generator is garbage collected.
+# A conversion that fails raises *subprocess.CalledProcessError* out of the
+# `async for`.  This needs Python 3.7 or later; drawer_labeler itself does
+# not.
+
+import asyncio
+import drawer_labeler
+import os
+import signal
+import subprocess
+import threading
+
+try:
+    from contextlib import aclosing
+except ImportError:
+    # Python 3.9 and earlier:
+    class aclosing:
+        def __init__(self, generator):
+            """ *aclosing*: Initialize a context that closes the async
+                *generator* on the way out. """
+            self._generator = generator
+
+        async def __aenter__(self):
+            """ *aclosing*: Return the generator. """
+            return self._generator
+
+        async def __aexit__(self, exception_type, exception_value,
+          traceback):
+            """ *aclosing*: Close the generator. """
+            await self._generator.aclose()
+            return False
+
+class PagesCancelled(Exception):
+    """ *PagesCancelled*: Raised in the drawing thread to stop it once the
+        pages are no longer wanted. """
+    pass
+
+class AsyncSvgRenderer(drawer_labeler.SvgRenderer):
+    def __init__(self, converter, cache=None, directory=".", validate=False,
+      limit=None):
+        """ *AsyncSvgRenderer*: Initialize a renderer whose SVG pages are
+            converted on an event loop by *converter*, at most *limit* at a
+            time (the converter's workers by default). """
+        # Check argument types:
+        assert limit is None or isinstance(limit, int) and limit >= 1
+
+        # Load up *self*:
+        drawer_labeler.SvgRenderer.__init__(self, converter, cache,
+          directory, validate)
+        if limit is None:
+            limit = converter._workers
+        self._limit = limit
+        self._loop = None
+        self._semaphore = None
+        self._finished = None
+        self._tasks = set()
+        self._room = None
+        self._cancelled = False
+
+    def start(self, loop):
+        """ *AsyncSvgRenderer*: Get ready to convert pages on *loop*. """
+        self._loop = loop
+        self._semaphore = asyncio.Semaphore(self._limit)
+        self._finished = asyncio.Queue()
+        self._tasks = set()
+        # The drawing thread waits once this many pages are not converted:
+        self._room = threading.Semaphore(2 * self._limit)
+        self._cancelled = False
+
+    def cancel(self):
+        """ *AsyncSvgRenderer*: Stop the drawing thread at its next page and
+            cancel every conversion. """
+        self._cancelled = True
+        for index in range(2 * self._limit):
+            self._room.release()
+        for task in self._tasks:
+            task.cancel()
+
+    def page_reuse(self, name, index, x_size, y_size, digest):
+        """ *AsyncSvgRenderer*: Copy a previously converted page out of the
+            cache and report it finished. """
+        if self._cancelled:
+            raise PagesCancelled()
+        reused = drawer_labeler.SvgRenderer.page_reuse(self, name, index,
+          x_size, y_size, digest)
+        if reused:
+            self._loop.call_soon_threadsafe(self._finished.put_nowait,
+              len(self._pdf_file_names) - 1)
+        return reused
+
+    def page_begin(self, name, index, x_size, y_size, digest=None):
+        """ *AsyncSvgRenderer*: Start an SVG page unless cancelled. """
+        if self._cancelled:
+            raise PagesCancelled()
+        return drawer_labeler.SvgRenderer.page_begin(self, name, index,
+          x_size, y_size, digest)
+
+    def page_end(self, page):
+        """ *AsyncSvgRenderer*: Write the SVG *page* out and have the event
+            loop convert it, waiting while too many pages are unconverted.
+        """
+        page.save()
+        index = self._page_indices.pop(page)
+        self._room.acquire()
+        if self._cancelled:
+            raise PagesCancelled()
+        self._loop.call_soon_threadsafe(self.task_start, index)
+
+    def task_start(self, index):
+        """ *AsyncSvgRenderer*: Start converting the *index*'th page. """
+        if self._cancelled:
+            return
+        task = self._loop.create_task(self.page_convert(index))
+        self._tasks.add(task)
+        task.add_done_callback(self._finished.put_nowait)
+
+    async def page_convert(self, index):
+        """ *AsyncSvgRenderer*: Convert the *index*'th SVG page to PDF and
+            return *index*. """
+        svg_file_name = self._svg_file_names[index]
+        pdf_file_name = self._converted_file_names[index]
+        converter = self._converter
+        async with self._semaphore:
+            with drawer_labeler.profiler.stage("inkscape"):
+                if type(converter).convert is \
+                  drawer_labeler.InkscapeConverter.convert:
+                    await self.command_run(
+                      converter.command(svg_file_name, pdf_file_name),
+                      pdf_file_name)
+                else:
+                    # Other converters (such as the `inkscape --shell` one)
+                    # keep their own processes, so they get a thread:
+                    await self._loop.run_in_executor(None, converter.convert,
+                      svg_file_name, pdf_file_name)
+        os.remove(svg_file_name)
+        return index
+
+    async def command_run(self, command, pdf_file_name):
+        """ *AsyncSvgRenderer*: Run *command* (a list of arguments) that
+            writes *pdf_file_name*, killing it if cancelled. """
+        # The command gets its own process group so that killing the group
+        # also gets anything that it started.  Starting is shielded so that
+        # a process started just as we are cancelled is still killed:
+        starting = asyncio.ensure_future(asyncio.create_subprocess_exec(
+          *command, start_new_session=True))
+        try:
+            process = await asyncio.shield(starting)
+            code = await process.wait()
+        except asyncio.CancelledError:
+            process = await starting
+            os.killpg(process.pid, signal.SIGKILL)
+            await process.wait()
+            if os.path.exists(pdf_file_name):
+                os.remove(pdf_file_name)
+            raise
+        if code != 0:
+            raise subprocess.CalledProcessError(code, command)
+
+    def finish(self):
+        """ *AsyncSvgRenderer*: Clean up and return the PDF file names in
+            page order. """
+        pdf_file_names = self._pdf_file_names
+        self._pdf_file_names = []
+        self._svg_file_names = []
+        self._converted_file_names = []
+        self._digests = []
+        self._page_indices = {}
+        self._tasks = set()
+        return pdf_file_names
+
+    def files_remove(self, indices):
+        """ *AsyncSvgRenderer*: Remove the files of every page whose index
+            is not in *indices*. """
+        for index in range(len(self._pdf_file_names)):
+            if index not in indices:
+                for file_name in (self._pdf_file_names[index],
+                  self._pdf_file_names[index][:-4] + ".svg"):
+                    if os.path.exists(file_name):
+                        os.remove(file_name)
+
+async def pages_finished(target, renderer=None, sheet=None):
+    """ Draw the pending drawers of *target* (an *Organizer* or *Organizers*)
+        as pages of *renderer* laid out on *sheet*, and generate an
+        (*index*, *pdf_file_name*) pair for each page as it is finished.
+        Pages finish out of order when more than one conversion runs at a
+        time; *index* is the page's place in the output.  Iterate inside
+        *aclosing* so that leaving early cleans up straight away. """
+    # Check argument types:
+    assert isinstance(target,
+      (drawer_labeler.Organizer, drawer_labeler.Organizers))
+    assert renderer is None or isinstance(renderer, drawer_labeler.Renderer)
+    assert sheet is None or isinstance(sheet, drawer_labeler.Sheet)
+
+    # Default to SVG pages converted by *inkscape*:
+    loop = asyncio.get_running_loop()
+    if renderer is None:
+        renderer = AsyncSvgRenderer(drawer_labeler.InkscapeConverter())
+
+    # The other renderers write a whole file with no subprocesses, so they
+    # just run in a thread:
+    if not isinstance(renderer, AsyncSvgRenderer):
+        file_names = await loop.run_in_executor(None, target.done,
+          renderer, sheet)
+        for index in range(len(file_names)):
+            yield index, file_names[index]
+        return
+
+    # Draw in a thread; the pages turn up in *finished* as they are done:
+    renderer.start(loop)
+    finished = renderer._finished
+    drawing = loop.run_in_executor(None, target.pages_draw, renderer, sheet)
+    drawing.add_done_callback(finished.put_nowait)
+    complete = False
+    indices = set()
+    try:
+        drawn = False
+        while not drawn or renderer._tasks:
+            item = await finished.get()
+            if item is drawing:
+                # Raise anything that went wrong while drawing:
+                item.result()
+                drawn = True
+                continue
+            if isinstance(item, int):
+                index = item
+            else:
+                renderer._tasks.discard(item)
+                renderer._room.release()
+                index = item.result()
+            indices.add(index)
+            yield index, renderer._pdf_file_names[index]
+        await loop.run_in_executor(None, renderer.pages_cache)
+        complete = True
+    finally:
+        if not complete:
+            renderer.cancel()
+            await asyncio.gather(drawing, *renderer._tasks,
+              return_exceptions=True)
+            renderer.files_remove(indices)
+        renderer.finish()
+
+async def done(target, renderer=None, sheet=None):
+    """ Generate all of the pending pages of *target* (an *Organizer* or
+        *Organizers*) like its *done* method does, without blocking the
+        event loop, and return the PDF file names in page order. """
+    pdf_file_names = {}
+    async with aclosing(pages_finished(target, renderer, sheet)) as pages:
+        async for index, pdf_file_name in pages:
+            pdf_file_names[index] = pdf_file_name
+    return [pdf_file_names[index] for index in sorted(pdf_file_names)]
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+# Benchmarks for drawer_labeler at catalog scale.  Each catalog size is run
+# in its own child process so that the peak memory figures are not polluted
+# by the other sizes.  Conversion uses *StubConverter*, so no inkscape (or
+# network) is needed.
+
+import argparse
+import drawer_labeler
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+class StubConverter(drawer_labeler.InkscapeConverter):
+    def convert(self, svg_file_name, pdf_file_name):
+        """ *StubConverter*: Pretend to convert *svg_file_name*. """
+        # The conversions overlap the drawing, so they time themselves:
+        with drawer_labeler.profiler.stage("stub.convert"):
+            out_file = open(pdf_file_name, "wb")
+            out_file.write(drawer_labeler.pdf_bytes(
+              "%PDF-1.4 stub of {0}\n".format(svg_file_name)))
+            out_file.close()
+
+def drawer_lines(index):
+    """ Return synthetic (*front_lines*, *bottom_lines*) for drawer *index*.
+    """
+    # Every line is a fresh string, as it would be when read from a file:
+    return (["Part {0}".format(index), "{0} Drawer".format("Synthetic")],
+      ["J:{0}".format(100000 + index)])
+
+def catalog_write(file_name, size):
+    """ Write a synthetic CSV catalog of *size* drawers to *file_name*. """
+    out_file = open(file_name, "w")
+    out_file.write("@organizer,Bench,116.0,49.0,12.0,4.0,2,5\n")
+    for index in range(size):
+        front_lines, bottom_lines = drawer_lines(index)
+        out_file.write("bench{0},{1},{2}\n".format(index,
+          "|".join(front_lines), "|".join(bottom_lines)))
+    out_file.close()
+
+def stages_time(function):
+    """ Call *function* with a fresh profiler enabled and return the
+        (*seconds*, *stages*) it took, where *stages* maps each profiler
+        stage name to its total seconds. """
+    profiler = drawer_labeler.Profiler()
+    profiler.enable()
+    drawer_labeler.profiler = profiler
+    start = time.time()
+    function()
+    seconds = time.time() - start
+    drawer_labeler.profiler = drawer_labeler.Profiler()
+    stages = {}
+    for name, stage in profiler._stages.items():
+        stages[name] = stage[1]
+    return seconds, stages
+
+def size_run(size, labels):
+    """ Benchmark a catalog of *size* drawers rendering *labels* of them and
+        return a dictionary of results. """
+    results = {"size": size, "labels": labels, "seconds": {}}
+    seconds = results["seconds"]
+    directory = tempfile.mkdtemp(prefix="drawer_labeler_benchmark-")
+    try:
+        # Build an in-memory catalog the way the built-in factories do,
+        # noting how much the peak memory grows while doing so:
+        start_kilobytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        organizer = drawer_labeler.Organizer(name="Bench", length=116.0,
+          width=49.0, height=12.0, font_height=4.0, front_rows=2,
+          labels_per_page=5)
+        for index in range(size):
+            front_lines, bottom_lines = drawer_lines(index)
+            organizer.drawer("bench{0}".format(index), front_lines,
+              bottom_lines)
+        seconds["catalog.build"] = time.time() - start
+        results["catalog_kilobytes"] = resource.getrusage(
+          resource.RUSAGE_SELF).ru_maxrss - start_kilobytes
+
+        # Compile a catalog file and then load it through its index:
+        catalog_file_name = os.path.join(directory, "bench.csv")
+        catalog_write(catalog_file_name, size)
+        start = time.time()
+        drawer_labeler.CatalogIndex.compile(catalog_file_name,
+          catalog_file_name + ".index")
+        seconds["catalog.compile"] = time.time() - start
+        start = time.time()
+        catalog_organizer = drawer_labeler.catalog_organizer(
+          catalog_file_name)
+        seconds["catalog.load"] = time.time() - start
+
+        # Look up an evenly spread sample of keys in both catalogs:
+        step = max(1, size // labels)
+        keys = ["bench{0}".format(index)
+          for index in range(0, size, step)][:labels]
+        for name, lookup_organizer in (("lookup.memory", organizer),
+          ("lookup.index", catalog_organizer)):
+            organizers = drawer_labeler.Organizers()
+            organizers.organizer_add(lookup_organizer)
+            start = time.time()
+            for key in keys:
+                organizers.draw(key)
+            seconds[name] = time.time() - start
+            organizers.pending_clear()
+
+        # Render the sample through both renderers:
+        organizer._pending = list(keys)
+        total, stages = stages_time(lambda: organizer.done(
+          drawer_labeler.SvgRenderer(StubConverter(), None, directory)))
+        seconds["svg.build"] = stages.get("page.draw", 0.0)
+        seconds["svg.serialize"] = stages.get("page.save", 0.0)
+        seconds["svg.convert"] = stages.get("stub.convert", 0.0)
+        seconds["svg.total"] = total
+        total, stages = stages_time(lambda: organizer.done(
+          drawer_labeler.PdfRenderer(os.path.join(directory, "labels.pdf"))))
+        seconds["pdf.build"] = stages.get("page.draw", 0.0)
+        seconds["pdf.serialize"] = (stages.get("page.save", 0.0) +
+          stages.get("pdf.close", 0.0))
+        seconds["pdf.total"] = total
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is not None:
+            total, stages = stages_time(lambda: organizer.done(
+              drawer_labeler.RasterRenderer(os.path.join(directory,
+              "labels.pbm"))))
+            seconds["raster.build"] = stages.get("page.draw", 0.0)
+            seconds["raster.serialize"] = (stages.get("page.save", 0.0) +
+              stages.get("raster.write", 0.0))
+            seconds["raster.total"] = total
+        organizer._pending = []
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    # Throughput and peak memory (Linux reports kilobytes):
+    results["labels_per_second"] = {}
+    for name in ("svg.total", "pdf.total", "raster.total"):
+        if seconds.get(name, 0.0) > 0.0:
+            results["labels_per_second"][name] = len(keys) / seconds[name]
+    results["peak_kilobytes"] = \
+      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results
+
+def report(all_results, baseline):
+    """ Print *all_results*, comparing them with *baseline* if given. """
+    for results in all_results:
+        size = results["size"]
+        print("Catalog of {0} drawers ({1} labels, peak {2} KB):".format(
+          size, results["labels"], results["peak_kilobytes"]))
+        old_results = None
+        if baseline is not None:
+            old_results = baseline.get(str(size))
+        seconds = results["seconds"]
+        for name in sorted(seconds.keys()):
+            line = "  {0:<16} {1:>10.4f}s".format(name, seconds[name])
+            if old_results is not None and \
+              old_results["seconds"].get(name, 0.0) > 0.0:
+                ratio = seconds[name] / old_results["seconds"][name]
+                line += "  {0:>6.2f}x baseline".format(ratio)
+                if ratio > 1.2 and seconds[name] > 0.01:
+                    line += "  SLOWER"
+            print(line)
+        for name in sorted(results["labels_per_second"].keys()):
+            print("  {0:<16} {1:>10.1f} labels/s".format(name,
+              results["labels_per_second"][name]))
+        line = "  {0:<16} {1:>10} KB ({2:.0f} bytes/drawer)".format(
+          "catalog.memory", results["catalog_kilobytes"],
+          results["catalog_kilobytes"] * 1024.0 / max(1, size))
+        if old_results is not None and \
+          old_results.get("catalog_kilobytes", 0) > 0:
+            line += "  {0:>6.2f}x baseline".format(
+              float(results["catalog_kilobytes"]) /
+              old_results["catalog_kilobytes"])
+        print(line)
+
+def main():
+    # Parse the command line:
+    parser = argparse.ArgumentParser(
+      description="Benchmark drawer label generation at catalog scale.")
+    parser.add_argument("--sizes", default="10,1000,100000",
+      help="comma separated catalog sizes (default: 10,1000,100000)")
+    parser.add_argument("--labels", type=int, default=1000,
+      help="maximum number of labels to render per catalog size")
+    parser.add_argument("--baseline", metavar="FILE",
+      help="compare the results with this previously saved baseline")
+    parser.add_argument("--save", metavar="FILE",
+      help="save the results as a new baseline")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    # A child benchmarks one size and prints its results as JSON:
+    if arguments.child is not None:
+        size = arguments.child
+        results = size_run(size, min(size, arguments.labels))
+        sys.stdout.write(json.dumps(results) + "\n")
+        return
+
+    all_results = []
+    for size in [int(size) for size in arguments.sizes.split(",")]:
+        output = subprocess.check_output([sys.executable,
+          os.path.abspath(__file__), "--child", str(size),
+          "--labels", str(arguments.labels)])
+        all_results.append(json.loads(output.decode("utf-8")))
+
+    baseline = None
+    if arguments.baseline:
+        in_file = open(arguments.baseline)
+        baseline = json.load(in_file)
+        in_file.close()
+    report(all_results, baseline)
+
+    if arguments.save:
+        out_file = open(arguments.save, "w")
+        json.dump(dict([(str(results["size"]), results)
+          for results in all_results]), out_file, indent=1, sort_keys=True)
+        out_file.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,683 @@
+#!/usr/bin/env python
+
+# Tests of drawer_labeler.  The `inkscape --shell` protocol is tested against
+# a stub `inkscape` that is put first on the PATH.  The stub is told how to
+# behave through environment variables:
+#
+#     STUB_VERSION  the version that `inkscape --version` reports
+#     STUB_PROMPT   the shell prompt, ">" for 0.92 and "> " for 1.x
+#     STUB_MODE     "ok" to convert, "noop" to answer without converting
+#                   or "hang" to never answer
+#
+# Each `inkscape` the stub runs as appends a line to $STUB_LOG, and each PDF
+# it writes says whether the shell or the one-shot command wrote it.  The
+# asyncio API is tested against *ASYNC_STUB*, a one-shot `inkscape` that
+# takes $STUB_DELAY seconds per page (four times that for page 0).
+
+import drawer_labeler
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    import asyncio
+    import drawer_labeler_async
+except (ImportError, SyntaxError):
+    # Python 2:
+    drawer_labeler_async = None
+
+STUB = r'''
+import os
+import sys
+import time
+
+version = os.environ["STUB_VERSION"]
+log = open(os.environ["STUB_LOG"], "a")
+arguments = sys.argv[1:]
+if arguments == ["--version"]:
+    log.write("version\n")
+    sys.stdout.write("Inkscape {0} (stub)\n".format(version))
+elif arguments == ["--shell"]:
+    log.write("shell\n")
+    log.flush()
+    prompt = os.environ["STUB_PROMPT"]
+    sys.stdout.write("Inkscape interactive shell mode. Type 'quit' to quit.\n")
+    sys.stdout.write(prompt)
+    sys.stdout.flush()
+    while True:
+        line = sys.stdin.readline()
+        if not line or line.strip() == "quit":
+            break
+        if os.environ["STUB_MODE"] == "hang":
+            time.sleep(60)
+        words = line.split()
+        pdf_file_name = None
+        if version.startswith("1.") and line.startswith("file-open:"):
+            actions = [action.strip() for action in line.split(";")]
+            pdf_file_name = actions[1][len("export-filename:"):]
+        elif version.startswith("0.") and words[:1] == ["-f"]:
+            pdf_file_name = words[3]
+        if pdf_file_name is not None and os.environ["STUB_MODE"] == "ok":
+            open(pdf_file_name, "w").write("shell\n")
+        sys.stdout.write(prompt)
+        sys.stdout.flush()
+else:
+    log.write("oneshot\n")
+    open(arguments[3], "w").write("oneshot\n")
+'''
+
+ASYNC_STUB = r'''
+import os
+import sys
+import time
+
+log = open(os.environ["STUB_LOG"], "a")
+svg_file_name, pdf_file_name = sys.argv[2], sys.argv[4]
+log.write("start {0} {1}\n".format(os.getpid(), time.time()))
+log.flush()
+if os.environ.get("STUB_FAIL"):
+    sys.exit(3)
+delay = float(os.environ["STUB_DELAY"])
+if svg_file_name.endswith("Test0.svg"):
+    delay *= 4
+time.sleep(delay)
+open(pdf_file_name, "w").write("oneshot\n")
+log.write("end {0} {1}\n".format(os.getpid(), time.time()))
+'''
+
+def stub_install(directory, source):
+    """ Write the stub `inkscape` *source* into *directory*, put it first
+        on the PATH and return the name of the log file that it writes. """
+    stub_file_name = os.path.join(directory, "inkscape")
+    stub_file = open(stub_file_name, "w")
+    stub_file.write("#!{0}\n{1}".format(sys.executable, source))
+    stub_file.close()
+    os.chmod(stub_file_name, 0o755)
+    log_file_name = os.path.join(directory, "log")
+    os.environ["PATH"] = directory + os.pathsep + os.environ["PATH"]
+    os.environ["STUB_LOG"] = log_file_name
+    return log_file_name
+
+class InkscapeShellTest(unittest.TestCase):
+    def setUp(self):
+        """ *InkscapeShellTest*: Put the stub `inkscape` first on the PATH.
+        """
+        self._directory = tempfile.mkdtemp()
+        self._environment = dict(os.environ)
+        self._log_file_name = stub_install(self._directory, STUB)
+        self._timeout = drawer_labeler.SHELL_TIMEOUT
+
+    def tearDown(self):
+        """ *InkscapeShellTest*: Put the PATH back and remove the stub. """
+        os.environ.clear()
+        os.environ.update(self._environment)
+        drawer_labeler.SHELL_TIMEOUT = self._timeout
+        shutil.rmtree(self._directory)
+
+    def pages_convert(self, version, prompt, mode, pages=3):
+        """ *InkscapeShellTest*: Convert *pages* pages through a stub that
+            behaves as *version*, *prompt* and *mode* say, and return the
+            contents of the PDFs and the stub's log. """
+        os.environ["STUB_VERSION"] = version
+        os.environ["STUB_PROMPT"] = prompt
+        os.environ["STUB_MODE"] = mode
+        converter = drawer_labeler.InkscapeShellConverter()
+        contents = []
+        try:
+            for index in range(pages):
+                base = os.path.join(self._directory, "page{0}".format(index))
+                open(base + ".svg", "w").write("<svg/>\n")
+                converter.convert(base + ".svg", base + ".pdf")
+                contents.append(open(base + ".pdf").read())
+        finally:
+            converter.close()
+        log = open(self._log_file_name).read().split()
+        return contents, log
+
+    def test_actions(self):
+        """ *InkscapeShellTest*: 1.x gets actions through one shell. """
+        contents, log = self.pages_convert("1.2.2", "> ", "ok")
+        self.assertEqual(contents, ["shell\n"] * 3)
+        self.assertEqual(log, ["version", "shell"])
+
+    def test_arguments(self):
+        """ *InkscapeShellTest*: 0.92 gets arguments through one shell. """
+        contents, log = self.pages_convert("0.92.4", ">", "ok")
+        self.assertEqual(contents, ["shell\n"] * 3)
+        self.assertEqual(log, ["version", "shell"])
+
+    def test_no_pdf(self):
+        """ *InkscapeShellTest*: A shell that answers without writing the
+            PDF is dropped for the one-shot command. """
+        contents, log = self.pages_convert("1.2.2", "> ", "noop")
+        self.assertEqual(contents, ["oneshot\n"] * 3)
+        self.assertEqual(log, ["version", "shell"] + ["oneshot"] * 3)
+
+    def test_hang(self):
+        """ *InkscapeShellTest*: A shell that stops answering times out and
+            is dropped for the one-shot command. """
+        drawer_labeler.SHELL_TIMEOUT = 1.0
+        contents, log = self.pages_convert("1.2.2", "> ", "hang")
+        self.assertEqual(contents, ["oneshot\n"] * 3)
+        self.assertEqual(log, ["version", "shell"] + ["oneshot"] * 3)
+
+    def test_no_version(self):
+        """ *InkscapeShellTest*: An `inkscape` that will not say its version
+            only gets the one-shot command. """
+        contents, log = self.pages_convert("unknown", ">", "ok")
+        self.assertEqual(contents, ["oneshot\n"] * 3)
+        self.assertEqual(log, ["version"] + ["oneshot"] * 3)
+
+def first_organizer():
+    """ Return an organizer that shares drawer "shared" with *second*. """
+    organizer = drawer_labeler.Organizer(name="First", length=116.0,
+      width=49.0, height=12.0, font_height=4.0, front_rows=2,
+      labels_per_page=5)
+    organizer.drawer("a1", ["A1"])
+    organizer.drawer("shared", ["First"])
+    return organizer
+
+def second_organizer():
+    """ Return an organizer that shares drawer "shared" with *first*. """
+    organizer = drawer_labeler.Organizer(name="Second", length=116.0,
+      width=49.0, height=12.0, font_height=4.0, front_rows=2,
+      labels_per_page=5)
+    organizer.drawer("b1", ["B1"])
+    organizer.drawer("shared", ["Second"])
+    return organizer
+
+class OrganizersTest(unittest.TestCase):
+    def setUp(self):
+        """ *OrganizersTest*: Make a manifest that knows both factories. """
+        self._directory = tempfile.mkdtemp()
+        self._manifest_file_name = os.path.join(self._directory, "f.json")
+        manifest = drawer_labeler.FactoryManifest(self._manifest_file_name,
+          [1])
+        manifest.keys_set("first_organizer", ["a1", "shared"])
+        manifest.keys_set("second_organizer", ["b1", "shared"])
+        manifest.save()
+
+    def tearDown(self):
+        """ *OrganizersTest*: Remove the manifest. """
+        shutil.rmtree(self._directory)
+
+    def organizers_make(self):
+        """ *OrganizersTest*: Return *Organizers* with both factories
+            registered lazily. """
+        manifest = drawer_labeler.FactoryManifest(self._manifest_file_name,
+          [1])
+        organizers = drawer_labeler.Organizers()
+        organizers.factory_add(first_organizer, manifest)
+        organizers.factory_add(second_organizer, manifest)
+        return organizers
+
+    def test_registration_order(self):
+        """ *OrganizersTest*: Organizers built out of order still keep
+            their registration order, and the first one registered wins. """
+        organizers = self.organizers_make()
+        self.assertEqual(organizers.select("b*"), ["b1"])
+        self.assertTrue(organizers.draw("shared"))
+        self.assertEqual([organizer._name
+          for organizer in organizers._organizers], ["First", "Second"])
+        self.assertEqual(organizers._index["shared"]._name, "First")
+        self.assertEqual(organizers.select("*"), ["a1", "shared", "b1"])
+
+    def test_lazy_winner(self):
+        """ *OrganizersTest*: Drawing a key that a built organizer has also
+            builds an earlier registered organizer that has it. """
+        organizers = self.organizers_make()
+        organizers.select("b*")
+        organizers.draw("shared")
+        self.assertEqual(organizers._organizers[0]._pending, ["shared"])
+        self.assertEqual(organizers._organizers[1]._pending, [])
+
+class CollisionTest(unittest.TestCase):
+    def setUp(self):
+        """ *CollisionTest*: Capture what is printed. """
+        self._directory = tempfile.mkdtemp()
+        self._stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        """ *CollisionTest*: Stop capturing and remove the catalog. """
+        sys.stdout = self._stdout
+        shutil.rmtree(self._directory)
+
+    def test_once(self):
+        """ *CollisionTest*: A collision with a catalog is reported once,
+            when the second organizer is added, however often it is drawn.
+        """
+        file_name = os.path.join(self._directory, "parts.csv")
+        out_file = open(file_name, "w")
+        out_file.write("@organizer,Parts,116.0,49.0,12.0,4.0,2,5\n"
+          "shared,Parts,\n")
+        out_file.close()
+        organizers = drawer_labeler.Organizers()
+        organizers.organizer_add(drawer_labeler.catalog_organizer(file_name))
+        self.assertFalse(organizers.organizer_add(first_organizer()))
+        self.assertEqual(sys.stdout.getvalue().count("'shared'"), 1)
+        for index in range(3):
+            self.assertTrue(organizers.draw("shared"))
+        self.assertEqual(sys.stdout.getvalue().count("'shared'"), 1)
+        self.assertEqual(organizers._organizers[0]._pending, ["shared"] * 3)
+
+def bad_organizer():
+    """ Return an organizer with a drawer whose lines are not strings. """
+    organizer = drawer_labeler.Organizer(name="Bad", length=116.0,
+      width=49.0, height=12.0, font_height=4.0, front_rows=2,
+      labels_per_page=5)
+    organizer.drawer("bad1", [1, 2])
+    return organizer
+
+class BadOrganizerTest(unittest.TestCase):
+    def test_lazy(self):
+        """ *BadOrganizerTest*: An invalid organizer built lazily raises
+            *ValueError* once and is not added. """
+        organizers = drawer_labeler.Organizers()
+        organizers.factory_add(bad_organizer)
+        self.assertRaises(ValueError, organizers.draw, "bad1")
+        self.assertFalse(organizers.draw("bad1"))
+        self.assertEqual(organizers._organizers, [])
+
+    def test_stale_manifest(self):
+        """ *BadOrganizerTest*: An invalid organizer is refused at
+            registration and its keys are not recorded. """
+        directory = tempfile.mkdtemp()
+        try:
+            manifest = drawer_labeler.FactoryManifest(os.path.join(
+              directory, "f.json"), [1])
+            organizers = drawer_labeler.Organizers()
+            self.assertRaises(ValueError, organizers.factory_add,
+              bad_organizer, manifest)
+            self.assertEqual(organizers._organizers, [])
+            self.assertEqual(manifest.keys_get("bad_organizer"), None)
+        finally:
+            shutil.rmtree(directory)
+
+class CatalogSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        """ *CatalogSnapshotTest*: Make a scratch directory. """
+        self._directory = tempfile.mkdtemp()
+        self._file_name = os.path.join(self._directory, "snapshot.json")
+
+    def tearDown(self):
+        """ *CatalogSnapshotTest*: Remove the scratch directory. """
+        shutil.rmtree(self._directory)
+
+    def changed(self, organizer):
+        """ *CatalogSnapshotTest*: Return the keys of *organizer* that
+            changed since the stored snapshot, and then save it. """
+        organizers = drawer_labeler.Organizers()
+        organizers.organizer_add(organizer)
+        snapshot = drawer_labeler.CatalogSnapshot(self._file_name)
+        keys = snapshot.changed(organizers)
+        snapshot.save()
+        return keys
+
+    def test_new(self):
+        """ *CatalogSnapshotTest*: The first run only records the labels. """
+        self.assertEqual(self.changed(organizer_make(3)), [])
+        self.assertTrue(os.path.exists(self._file_name))
+
+    def test_unchanged(self):
+        """ *CatalogSnapshotTest*: Nothing changed, nothing is returned. """
+        self.changed(organizer_make(3))
+        self.assertEqual(self.changed(organizer_make(3)), [])
+
+    def test_changed(self):
+        """ *CatalogSnapshotTest*: Edited and added drawers are returned in
+            catalog order. """
+        self.changed(organizer_make(3))
+        organizer = organizer_make(4)
+        organizer.drawer("k1", ["Part 1", "Edited"])
+        self.assertEqual(self.changed(organizer), ["k1", "k3"])
+        self.assertEqual(self.changed(organizer), [])
+
+class PageCacheTest(unittest.TestCase):
+    def setUp(self):
+        """ *PageCacheTest*: Make a scratch directory. """
+        self._directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """ *PageCacheTest*: Remove the scratch directory. """
+        shutil.rmtree(self._directory)
+
+    def test_eviction(self):
+        """ *PageCacheTest*: The least recently used pages are evicted
+            until the cache fits in its maximum size. """
+        cache = drawer_labeler.PageCache(self._directory, 25)
+        cache.put("a", b"a" * 10)
+        time.sleep(0.01)
+        cache.put("b", b"b" * 10)
+        time.sleep(0.01)
+        self.assertEqual(cache.get("a"), b"a" * 10)
+        time.sleep(0.01)
+        cache.put("c", b"c" * 10)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), b"a" * 10)
+        self.assertEqual(cache.get("c"), b"c" * 10)
+        self.assertFalse(os.path.exists(cache.path("b")))
+
+        # A page bigger than the cache does not stay in it:
+        cache.put("d", b"d" * 30)
+        self.assertEqual(sorted(cache._entries.keys()), [])
+        self.assertEqual(sorted(os.listdir(self._directory)), [])
+
+    def test_reload(self):
+        """ *PageCacheTest*: Pages survive into a new *PageCache*. """
+        drawer_labeler.PageCache(self._directory, 100).put("a", b"page")
+        cache = drawer_labeler.PageCache(self._directory, 100)
+        self.assertTrue("a" in cache)
+        self.assertFalse("b" in cache)
+        self.assertEqual(cache.get("a"), b"page")
+
+class CatalogIndexTest(unittest.TestCase):
+    def setUp(self):
+        """ *CatalogIndexTest*: Make a scratch directory. """
+        self._directory = tempfile.mkdtemp()
+        self._file_name = os.path.join(self._directory, "parts.csv")
+
+    def tearDown(self):
+        """ *CatalogIndexTest*: Remove the scratch directory. """
+        shutil.rmtree(self._directory)
+
+    def catalog_write(self, rows):
+        """ *CatalogIndexTest*: Write a catalog with drawer *rows*. """
+        out_file = open(self._file_name, "w")
+        out_file.write("@organizer,Parts,116.0,49.0,12.0,4.0,2,5\n")
+        for row in rows:
+            out_file.write(row + "\n")
+        out_file.close()
+
+    def test_round_trip(self):
+        """ *CatalogIndexTest*: The index gives back the catalog. """
+        self.catalog_write(["r2,Two|Resistor,J:2", "r10,Ten,",
+          "c1,One|Capacitor,"])
+        index = drawer_labeler.CatalogIndex(self._file_name)
+        self.assertTrue(os.path.exists(self._file_name + ".index"))
+        self.assertEqual(index.items(), [
+          ("r2", ["Two", "Resistor"], ["J:2"]), ("r10", ["Ten"], []),
+          ("c1", ["One", "Capacitor"], [])])
+        self.assertEqual(index.keys(), ["r2", "r10", "c1"])
+        self.assertEqual(index.find("c0"), -1)
+        self.assertEqual(index.lines(index.find("r10")), (["Ten"], []))
+        self.assertEqual(index.scan("r", lambda key: key.startswith("r")),
+          [("r10", 1), ("r2", 0)])
+        self.assertEqual(index._geometry["name"], "Parts")
+
+    def test_rebuild(self):
+        """ *CatalogIndexTest*: A catalog whose size or modification time
+            changed gets its index rebuilt. """
+        self.catalog_write(["r1,One,"])
+        drawer_labeler.CatalogIndex(self._file_name)
+
+        # The same size but a new modification time:
+        self.catalog_write(["r1,Won,"])
+        status = os.stat(self._file_name)
+        os.utime(self._file_name, (status.st_atime, status.st_mtime + 10))
+        index = drawer_labeler.CatalogIndex(self._file_name)
+        self.assertEqual(index.items(), [("r1", ["Won"], [])])
+
+        # A new size:
+        self.catalog_write(["r1,Won,", "r2,Two,"])
+        index = drawer_labeler.CatalogIndex(self._file_name)
+        self.assertEqual(index.keys(), ["r1", "r2"])
+
+class SelectTest(unittest.TestCase):
+    def setUp(self):
+        """ *SelectTest*: Make a catalog with keys "k5x" and "a1". """
+        self._directory = tempfile.mkdtemp()
+        self._file_name = os.path.join(self._directory, "parts.csv")
+        out_file = open(self._file_name, "w")
+        out_file.write("@organizer,Parts,116.0,49.0,12.0,4.0,2,5\n"
+          "k5x,K5x,\na1,A1,\n")
+        out_file.close()
+
+    def tearDown(self):
+        """ *SelectTest*: Remove the scratch directory. """
+        shutil.rmtree(self._directory)
+
+    def organizers_make(self, catalog_first):
+        """ *SelectTest*: Return *Organizers* holding "k0" to "k11" and the
+            catalog, which is registered first if *catalog_first*. """
+        organizers = drawer_labeler.Organizers()
+        catalog_organizer = drawer_labeler.catalog_organizer(self._file_name)
+        if catalog_first:
+            organizers.organizer_add(catalog_organizer)
+        organizers.organizer_add(organizer_make(12))
+        if not catalog_first:
+            organizers.organizer_add(catalog_organizer)
+        organizers.pending_clear()
+        return organizers
+
+    def test_glob(self):
+        """ *SelectTest*: Globs match in catalog order. """
+        organizers = self.organizers_make(False)
+        self.assertEqual(organizers.select("k1*"), ["k1", "k10", "k11"])
+        self.assertEqual(organizers.select("k?"), ["k0", "k1", "k2", "k3",
+          "k4", "k5", "k6", "k7", "k8", "k9"])
+        self.assertEqual(organizers.select("k[5-6]*"), ["k5", "k6", "k5x"])
+        self.assertEqual(organizers.select("z*"), [])
+
+    def test_range(self):
+        """ *SelectTest*: Ranges are inclusive and sort as strings. """
+        organizers = self.organizers_make(False)
+        self.assertEqual(organizers.select("k2..k5"),
+          ["k2", "k3", "k4", "k5"])
+        self.assertEqual(organizers.select("k1..k10"), ["k1", "k10"])
+        self.assertEqual(organizers.select("a0..a9"), ["a1"])
+
+    def test_catalog_order(self):
+        """ *SelectTest*: Organizers registered first come first. """
+        self.assertEqual(self.organizers_make(False).select("k5*"),
+          ["k5", "k5x"])
+        self.assertEqual(self.organizers_make(True).select("k5*"),
+          ["k5x", "k5"])
+
+class LinesFitTest(unittest.TestCase):
+    def width(self, text):
+        """ *LinesFitTest*: Return the width (mm) of *text* at full size. """
+        return drawer_labeler.font_metrics.width(text) * \
+          drawer_labeler.FONT_SIZE
+
+    def test_fit(self):
+        """ *LinesFitTest*: Lines that fit are left alone. """
+        size = drawer_labeler.FONT_SIZE
+        self.assertEqual(drawer_labeler.lines_fit(["Hi", "There"], 2, 40.0),
+          ([("Hi", size), ("There", size)], []))
+
+    def test_wrap(self):
+        """ *LinesFitTest*: A long line wraps onto a spare row. """
+        size = drawer_labeler.FONT_SIZE
+        room = max(self.width("Hello"), self.width("World")) + 0.1
+        self.assertTrue(self.width("Hello World") > room)
+        self.assertEqual(drawer_labeler.lines_fit(["Hello World"], 2, room),
+          ([("Hello", size), ("World", size)], []))
+
+    def test_shrink(self):
+        """ *LinesFitTest*: With no spare row a long line is shrunk. """
+        size = drawer_labeler.FONT_SIZE
+        room = self.width("Hello World") * 0.8
+        fitted, overflows = drawer_labeler.lines_fit(["Hello World"], 1,
+          room)
+        self.assertEqual(overflows, [])
+        self.assertEqual(fitted[0][0], "Hello World")
+        self.assertAlmostEqual(fitted[0][1], size * 0.8)
+
+    def test_overflow(self):
+        """ *LinesFitTest*: A line too long even at the smallest size is
+            drawn at that size and reported. """
+        size = drawer_labeler.FONT_SIZE
+        room = self.width("Hello World") * 0.5
+        self.assertEqual(drawer_labeler.lines_fit(["Hello World"], 2, room),
+          ([("Hello World", size * drawer_labeler.MINIMUM_FONT_SCALE)],
+          ["Hello World"]))
+
+class LabelServerTest(unittest.TestCase):
+    def setUp(self):
+        """ *LabelServerTest*: Work in a scratch directory. """
+        self._directory = tempfile.mkdtemp()
+        self._current_directory = os.getcwd()
+        os.chdir(self._directory)
+
+    def tearDown(self):
+        """ *LabelServerTest*: Remove the scratch directory. """
+        os.chdir(self._current_directory)
+        shutil.rmtree(self._directory)
+
+    def test_extension(self):
+        """ *LabelServerTest*: Outputs default to the renderer's extension
+            and other extensions are refused. """
+        organizers = drawer_labeler.Organizers()
+        organizers.organizer_add(organizer_make(3))
+        organizers.pending_clear()
+        def renderer_create(directory):
+            return drawer_labeler.PdfRenderer(os.path.join(directory,
+              "labels.png"))
+        server = drawer_labeler.LabelServer(organizers, renderer_create,
+          None, "png")
+        response = server.job_run({"keys": ["k0"]})
+        self.assertEqual(response["files"],
+          [os.path.join(os.getcwd(), "labels1.png")])
+        response = server.job_run({"keys": ["k1"], "output": "k1.pdf"})
+        self.assertFalse(response["ok"])
+        self.assertFalse(os.path.exists("k1.pdf"))
+        response = server.job_run({"keys": ["k2"], "output": "k2.PNG"})
+        self.assertTrue(response["ok"])
+
+def organizer_make(size):
+    """ Return an organizer with *size* drawers "k0", "k1", ... all of
+        which are to be drawn, five to a page. """
+    organizer = drawer_labeler.Organizer(name="Test", length=116.0,
+      width=49.0, height=12.0, font_height=4.0, front_rows=2,
+      labels_per_page=5)
+    for index in range(size):
+        key = "k{0}".format(index)
+        organizer.drawer(key, ["Part {0}".format(index)])
+        organizer.draw(key)
+    return organizer
+
+@unittest.skipIf(drawer_labeler_async is None, "needs Python 3")
+class AsyncTest(unittest.TestCase):
+    def setUp(self):
+        """ *AsyncTest*: Put the sleeping stub `inkscape` first on the PATH.
+        """
+        self._directory = tempfile.mkdtemp()
+        self._environment = dict(os.environ)
+        self._log_file_name = stub_install(self._directory, ASYNC_STUB)
+        os.environ["STUB_DELAY"] = "0.2"
+        self._loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        """ *AsyncTest*: Put the PATH back and remove the stub. """
+        self._loop.close()
+        os.environ.clear()
+        os.environ.update(self._environment)
+        shutil.rmtree(self._directory)
+
+    def pages_make(self, limit=2):
+        """ *AsyncTest*: Return the *pages_finished* generator for the six
+            pages of a 30 drawer organizer, at most *limit* converted at a
+            time. """
+        renderer = drawer_labeler_async.AsyncSvgRenderer(
+          drawer_labeler.InkscapeConverter(limit), None, self._directory)
+        return drawer_labeler_async.pages_finished(organizer_make(30),
+          renderer)
+
+    def pages_take(self, pages, count=None):
+        """ *AsyncTest*: Return the first *count* (all if *None*) pairs that
+            the *pages* generator yields, and then close it. """
+        run = self._loop.run_until_complete
+        pairs = []
+        try:
+            while count is None or len(pairs) < count:
+                try:
+                    pairs.append(run(pages.__anext__()))
+                except StopAsyncIteration:
+                    break
+        finally:
+            run(pages.aclose())
+        return pairs
+
+    def log_read(self):
+        """ *AsyncTest*: Return a list of (*event*, *pid*, *time*) from the
+            stub's log. """
+        events = []
+        for line in open(self._log_file_name).read().splitlines():
+            event, pid, when = line.split()
+            events.append((event, int(pid), float(when)))
+        return events
+
+    def files_list(self, extension):
+        """ *AsyncTest*: Return the sorted page files ending in *extension*.
+        """
+        return sorted([os.path.join(self._directory, file_name)
+          for file_name in os.listdir(self._directory)
+          if file_name.startswith("Test") and file_name.endswith(extension)])
+
+    def test_limit_and_order(self):
+        """ *AsyncTest*: No more than *limit* conversions run at once and
+            the slow first page is not the first one handed back. """
+        pairs = self.pages_take(self.pages_make(2))
+        self.assertEqual(sorted([index for index, file_name in pairs]),
+          list(range(6)))
+        self.assertNotEqual(pairs[0][0], 0)
+        running = 0
+        most = 0
+        events = sorted([(when, event) for event, pid, when
+          in self.log_read()])
+        for when, event in events:
+            running += 1 if event == "start" else -1
+            most = max(most, running)
+        self.assertEqual(most, 2)
+        self.assertEqual(self.files_list(".pdf"),
+          sorted([file_name for index, file_name in pairs]))
+        self.assertEqual(self.files_list(".svg"), [])
+
+    def test_done(self):
+        """ *AsyncTest*: *done* returns the PDF file names in page order. """
+        renderer = drawer_labeler_async.AsyncSvgRenderer(
+          drawer_labeler.InkscapeConverter(3), None, self._directory)
+        file_names = self._loop.run_until_complete(
+          drawer_labeler_async.done(organizer_make(30), renderer))
+        self.assertEqual(file_names, [os.path.join(self._directory,
+          "Test{0}.pdf".format(index)) for index in range(6)])
+
+    def test_close_early(self):
+        """ *AsyncTest*: Closing after the first page kills the running
+            conversions and removes every page not handed back. """
+        pairs = self.pages_take(self.pages_make(2), 1)
+        self.assertEqual(self.files_list(".pdf"), [pairs[0][1]])
+        self.assertEqual(self.files_list(".svg"), [])
+        ended = set([pid for event, pid, when in self.log_read()
+          if event == "end"])
+        killed = [pid for event, pid, when in self.log_read()
+          if event == "start" and pid not in ended]
+        self.assertTrue(killed)
+        for pid in killed:
+            self.assertRaises(OSError, os.kill, pid, 0)
+
+        # Nothing turns up later either:
+        time.sleep(1.0)
+        self.assertEqual(self.files_list(".pdf"), [pairs[0][1]])
+
+    def test_failure(self):
+        """ *AsyncTest*: A failed conversion raises *CalledProcessError* and
+            leaves no page files behind. """
+        os.environ["STUB_FAIL"] = "1"
+        self.assertRaises(subprocess.CalledProcessError, self.pages_take,
+          self.pages_make(2))
+        self.assertEqual(self.files_list(".pdf"), [])
+        self.assertEqual(self.files_list(".svg"), [])
+
+if __name__ == "__main__":
+    unittest.main()